@@ -15,8 +15,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-__all__ = ["radl", "parse_radl", "parse_radl_json", "dump_radl", "dump_radl_json", "dump_radl_simple"]
+__all__ = ["radl", "parse_radl", "parse_radl_iter", "parse_radl_json", "dump_radl", "dump_radl_to", "dump_radl_json", "dump_radl_json_to", "dump_radl_simple",
+           "radl_to_json", "json_to_radl"]
 
 from . import radl
-from .radl_parse import parse_radl, dump_radl
-from .radl_json import parse_radl as parse_radl_json, dump_radl as dump_radl_json, radlToSimple as dump_radl_simple
+from .radl_parse import parse_radl, dump_radl, dump_radl_to
+from .radl_fastparse import parse_radl_iter
+from .radl_json import parse_radl as parse_radl_json, dump_radl as dump_radl_json, dump_radl_to as dump_radl_json_to, \
+                        radlToSimple as dump_radl_simple
+from .radl_transcode import radl_to_json, json_to_radl
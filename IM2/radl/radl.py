@@ -15,7 +15,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import copy
+import hashlib
 import itertools
+import weakref
+from contextlib import contextmanager
 from collections import OrderedDict
 try:
 	from urlparse import urlparse
@@ -24,6 +27,59 @@ except ImportError:
 	from urllib.parse import urlparse
 	le2 = lambda a,b: True if a is None else False if b is None else a <= b
 import heapq as heap
+try:
+	import yaml
+	# The loader of libyaml is several times faster, if PyYAML was built with it
+	_YAMLLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+except ImportError:
+	yaml = None
+
+try:
+	_intern = intern
+except NameError:
+	from sys import intern as _intern
+
+PICKLE_VERSION = 1
+"""
+Version of the state pickled by the classes in this module. Increase it when
+that state changes, so pickles stored by other processes are not reused.
+"""
+
+def intern_name(name):
+	"""Return the shared copy of a property name, so features with the same name share it."""
+
+	return _intern(name) if type(name) is str else name
+
+_NUMBERED_NAMES = {}
+"""Cache for ``split_numbered_name``."""
+
+def split_numbered_name(name):
+	"""
+	Split a property name like ``disk.0.os.name`` into ``("disk", 0, "os.name")``.
+
+	The index is None if it is not a number, and the suffix is None if there is
+	nothing after the index. Return None if the name has no dot.
+	"""
+
+	r = _NUMBERED_NAMES.get(name, False)
+	if r is False:
+		(prefix, sep, tail) = name.partition(".")
+		if not sep:
+			r = None
+		else:
+			(num, sep, suffix) = tail.partition(".")
+			try:
+				num = int(num)
+			except ValueError:
+				num = None
+			r = (prefix, num, suffix if sep else None)
+		_NUMBERED_NAMES[name] = r
+	return r
+
+def load_yaml(text):
+	"""Decode a YAML document, or return it as is if PyYAML is not available."""
+
+	return yaml.load(text, Loader=_YAMLLoader) if yaml else text
 
 def UnitToValue(unit):
 	"""Return the value of an unit."""
@@ -103,6 +159,66 @@ def _combinations(c):
 			heap.heappush(combs, (ci1[0]-c[i][0][0]+score0, c1))
 
 
+class _Journal(object):
+	"""
+	Changes done by a merge, to undo them if the merge fails.
+
+	Every change to the RADL objects done by ``merge`` and ``add`` goes through
+	these methods, so the cost of undoing a merge is proportional to what the
+	merge changed and not to the size of the document.
+	"""
+
+	def __init__(self):
+		self.undo = []
+
+	def _record(self, func, *args):
+		self.undo.append((func, args))
+
+	def setitem(self, d, key, value):
+		if key in d:
+			self._record(d.__setitem__, key, d[key])
+		else:
+			self._record(d.pop, key, None)
+		d[key] = value
+
+	def setdefault(self, d, key, default):
+		if key not in d:
+			self.setitem(d, key, default)
+		return d[key]
+
+	def add(self, s, value):
+		if value not in s:
+			self._record(s.discard, value)
+			s.add(value)
+
+	def setattr(self, obj, name, value):
+		self._record(setattr, obj, name, getattr(obj, name))
+		setattr(obj, name, value)
+
+	def changed(self, features):
+		"""Drop the cached values of a Features now and after undoing the changes."""
+
+		self._record(features._changed)
+		features._changed()
+
+	def rollback(self):
+		"""Undo the changes in reverse order."""
+
+		while self.undo:
+			func, args = self.undo.pop()
+			func(*args)
+
+class _NoJournal(_Journal):
+	"""Apply the changes without recording them."""
+
+	def _record(self, func, *args):
+		pass
+
+	def changed(self, features):
+		features._changed()
+
+_NO_JOURNAL = _NoJournal()
+
 class Feature(object):
 	"""
 	Every property that can appear in the definitions of a ``network`` and ``system``.
@@ -115,13 +231,23 @@ class Feature(object):
 	- line: line number in the RADL document.
 	"""
 
+	__slots__ = ("prop", "operator", "value", "unit", "line")
+
 	def __init__(self, prop = None, operator = None, value = None, unit = '', line=None):
-		self.prop = prop
+		self.prop = intern_name(prop)
 		self.operator = operator
 		self.value = value
 		self.unit = unit
 		self.line = line
 
+	def __getstate__(self):
+		return dict((k, getattr(self, k)) for k in Feature.__slots__)
+
+	def __setstate__(self, state):
+		for k, v in state.items():
+			setattr(self, k, v)
+		self.prop = intern_name(self.prop)
+
 	def __repr__(self):
 		return "%s %s %s" % (self.prop, self.operator, repr(self.getValue()))
 
@@ -140,7 +266,8 @@ class Feature(object):
 	def clone(self):
 		"""Return a copy of this feature."""
 
-		return copy.deepcopy(self)
+		value = self.value.clone() if isinstance(self.value, Features) else copy.deepcopy(self.value)
+		return Feature(self.prop, self.operator, value, self.unit, self.line)
 
 	def getValue(self, unit=None):
 		"""
@@ -165,7 +292,7 @@ class Feature(object):
 		Check type, operator and unit in a feature.
 
 		Args:
-		- check(tuple):
+		- check(tuple or FeatureCheck):
 		   - v[0]: expected type of the feature value.
 		   - v[1]: can be a list of possible values or a function to test the value or None.
 		   - v[2] (optional): can be a list of possible units; if None or not set the
@@ -173,60 +300,203 @@ class Feature(object):
 		- radl: second argument passed when calling v[1].
 		"""
 
+		if not isinstance(check, FeatureCheck):
+			check = FeatureCheck(check)
+		return check.check(self, radl)
+
+_STR_OPERATORS = frozenset(("=", "contains"))
+_NUM_OPERATORS = frozenset(("=", "<=", ">=", ">", "<"))
+
+class FeatureCheck(object):
+	"""
+	Check of a feature, as the tuple passed to ``Feature._check``, with the sets of
+	valid values and units upper-cased once.
+	"""
+
+	__slots__ = ("types", "spec", "values", "func", "units", "unit_required")
+
+	def __init__(self, check):
+		self.types, self.spec = check[0], check
+		self.values = self.func = None
+		if isinstance(check[1], (set, frozenset, tuple, list)):
+			self.values = frozenset(v.upper() for v in check[1])
+		elif callable(check[1]):
+			self.func = check[1]
+		# units is None if no unit is valid, and empty if any unit is valid
+		self.units = self.unit_required = None
+		if len(check) > 2 and check[2] is not None:
+			self.units = check[2] and frozenset(u.upper() if u else u for u in check[2])
+			self.unit_required = None not in self.units if self.units else False
+
+	def check(self, f, radl):
+		"""Check type, operator, value and unit of the feature ``f``."""
+
+		value = f.value
 		# Check type
-		if not isinstance(self.value, check[0]):
-			raise RADLParseException("Invalid type on '%s': '%s'; expected %s, but %s" % (self.prop, str(self.value), str(check[0]), type(self.value)), line=self.line)
+		if not isinstance(value, self.types):
+			raise RADLParseException("Invalid type on '%s': '%s'; expected %s, but %s" % (f.prop, str(value), str(self.types), type(value)), line=f.line)
 		# Check operator
-		if isinstance(self.value, (str, Aspect)):
-			if self.operator != "=" and self.operator != "contains":
+		if isinstance(value, (str, Aspect)):
+			if f.operator not in _STR_OPERATORS:
 				raise RADLParseException("Invalid operator; expected '=' or 'contains'",
-				                         line=self.line)
-		elif isinstance(self.value, (int, float)):
-			if self.operator not in ["=", "<=", ">=", ">", "<"]:
+				                         line=f.line)
+		elif isinstance(value, (int, float)):
+			if f.operator not in _NUM_OPERATORS:
 				raise RADLParseException("Invalid operator; expected '=', '<=', " +
-					 "'>=', '>' or '<'", line=self.line)
-		elif isinstance(self.value, Features):
-			if self.operator != "contains":
+					 "'>=', '>' or '<'", line=f.line)
+		elif isinstance(value, Features):
+			if f.operator != "contains":
 				raise RADLParseException(
-					"Invalid operator; expected 'contains'", line=self.line)
+					"Invalid operator; expected 'contains'", line=f.line)
 		# Check value
-		if isinstance(check[1], (set, frozenset, tuple, list)):
-			if self.value.upper() not in check[1]:
-				raise RADLParseException("Invalid value; expected one of %s" % check[1],
-				                         line=self.line)
-		elif callable(check[1]):
-			if not check[1](self, radl):
-				raise RADLParseException("Invalid value in property '%s': %s" % (self.prop, self.value), line=self.line)
-		if isinstance(self.value, Aspect) and id(radl.get(self.value)) != id(self.value):
-				raise RADLParseException("Object referenced is not in RADL in property '%s': %s, %s" % (self.prop, id(self.value), id(radl.get(self.value))), line=self.line)
-			
+		if self.values is not None:
+			if value.upper() not in self.values:
+				raise RADLParseException("Invalid value; expected one of %s" % self.spec[1],
+				                         line=f.line)
+		elif self.func is not None:
+			if not self.func(f, radl):
+				raise RADLParseException("Invalid value in property '%s': %s" % (f.prop, f.value), line=f.line)
+		if isinstance(f.value, Aspect) and id(radl.get(f.value)) != id(f.value):
+				raise RADLParseException("Object referenced is not in RADL in property '%s': %s, %s" % (f.prop, id(f.value), id(radl.get(f.value))), line=f.line)
+
 		# Check unit
-		if len(check) < 3 or check[2] == None:
-			if self.unit:
-				raise RADLParseException("Invalid unit; expected none", line=self.line)
-		elif len(check) > 2 and check[2]:
-			if self.unit is None:
-				if self.unit not in check[2]:
-					raise RADLParseException("Empty unit; expected some value", line=self.line)
-			else:
-				if self.unit.upper() not in check[2]:
-					raise RADLParseException("Invalid unit; expected one of %s" % check[2], line=self.line)
+		if self.units is None:
+			if f.unit:
+				raise RADLParseException("Invalid unit; expected none", line=f.line)
+		elif self.units:
+			if f.unit is None:
+				if self.unit_required:
+					raise RADLParseException("Empty unit; expected some value", line=f.line)
+			elif f.unit.upper() not in self.units:
+				raise RADLParseException("Invalid unit; expected one of %s" % self.spec[2], line=f.line)
 		return True
 
+class FeatureChecks(dict):
+	"""Checks by property name, as returned by ``compile_checks``."""
+
+def compile_checks(checks):
+	"""
+	Return the checks passed to ``Features.check_simple`` or ``Features.check_num``
+	with every tuple replaced by a ``FeatureCheck``.
+
+	Aspect classes compile their checks once, so ``check`` does not prepare them
+	again for every feature.
+	"""
+
+	if isinstance(checks, FeatureChecks):
+		return checks
+	return FeatureChecks((k, compile_checks(v) if isinstance(v, dict) else FeatureCheck(v))
+	                     for k, v in checks.items())
+
+def sorted_features(fs):
+	"""
+	Return the features in a ``contains`` set in an order that does not depend on
+	hashes, so it is the same in every process and after pickling.
+	"""
+
+	if len(fs) < 2:
+		return list(fs)
+	return sorted(fs, key=lambda f: Features._token(f, []))
+
 class Features(object):
 	"""
 	Collects a group of features.
 	"""
 
+	_features = None
+	"""Cached value of ``features``."""
+
+	_hash = None
+	"""Cached value of ``__hash__``."""
+
+	_numbered = None
+	"""Cached value of ``_getNumbered``."""
+
+	_digest = None
+	"""Cached value of ``_getDigest``."""
+
+	_shared = False
+	"""Whether ``props`` may be shared with a clone, so it is copied before changing it."""
+
+	_copyrefs = False
+	"""Whether the aspects referenced from a shared ``props`` are copied with it."""
+
+	_keep = ()
+	"""Aspects referenced from ``props`` that are never copied with it."""
+
+	_frozen = False
+	"""Whether it is read-only; see ``FrozenAspect``."""
+
 	def __init__(self, features=None):
 		self.props = {}
 		for f in (features if features else []):
 			self.addFeature(f)
 
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		for k in ("_features", "_hash", "_numbered", "_digest", "_shared", "_copyrefs", "_keep"):
+			state.pop(k, None)
+		return state
+
+	def _unshare(self, journal=None):
+		"""Copy ``props`` if it is shared with a clone."""
+
+		if not self._shared: return
+		j = journal or _NO_JOURNAL
+		# The original keeps the aspects it references, and a clone gets copies
+		memo = dict((id(a), a.clone() if self._copyrefs else a) for a in self._references())
+		memo.update((id(a), a) for a in self._keep)
+		j.changed(self)
+		j.setattr(self, "props", copy.deepcopy(self.props, memo))
+		j.setattr(self, "_shared", False)
+		j.setattr(self, "_copyrefs", False)
+		j.setattr(self, "_keep", ())
+
+	def _references(self):
+		"""Return the aspects referenced from the features, also from the nested ones."""
+
+		r = []
+		for f in self.features:
+			if isinstance(f.value, Aspect):
+				r.append(f.value)
+			elif isinstance(f.value, Features) and f.value is not self:
+				r.extend(f.value._references())
+		return r
+
+	def _relink(self, radl):
+		"""Make the references to aspects point to the ones with the same key in ``radl``."""
+
+		fs = [ (f, radl.get(f.value)) for f in self.features if isinstance(f.value, Aspect) ]
+		fs = [ (f, a) for f, a in fs if a is not f.value ]
+		if not fs: return
+		if self._shared and all(self.props.get(f.prop) is f for f, _ in fs):
+			# Replace only these features, and keep sharing the rest
+			props = dict(self.props)
+			for f, a in fs:
+				props[f.prop] = Feature(f.prop, f.operator, a, f.unit, f.line)
+			self.props, self._keep = props, self._keep + tuple(a for _, a in fs)
+			self._changed()
+			return
+		self._unshare()
+		for f in self.features:
+			if isinstance(f.value, Aspect):
+				f.value = radl.get(f.value)
+		self._changed()
+
+	def _changed(self):
+		"""Drop the cached values after a change in ``props``."""
+
+		self._features = self._hash = self._numbered = self._digest = None
+
 	@property
 	def features(self):
-		"""List of features."""
+		"""List of features; it is shared, so do not modify it."""
 
+		if self._features is None:
+			self._features = self._getFeatures()
+		return self._features
+
+	def _getFeatures(self):
 		r = []
 		for p, inter in self.props.items():
 			if isinstance(inter, tuple):
@@ -237,7 +507,9 @@ class Features(object):
 					r.extend([f for f in inter if f])
 			elif isinstance(inter, dict):
 				r.extend(inter.values())
-			elif isinstance(inter, (list, set)):
+			elif isinstance(inter, set):
+				r.extend(sorted_features(inter))
+			elif isinstance(inter, list):
 				r.extend(inter)
 			else:
 				r.append(inter)
@@ -255,18 +527,129 @@ class Features(object):
 	__cmp__ = None
 
 	def __hash__(self):
+		if self._hash is None:
+			# Nested features can change without this knowing, so the properties
+			# with them are hashed again on every call
+			hs = [ (p, None if Features._hasNested(self.props[p]) else Features._hashProp(self.props[p]))
+			       for p in sorted(self.props.keys()) ]
+			self._hash = hs if any(h is None for _, h in hs) else Features._joinHashes(hs)
+		if not isinstance(self._hash, list):
+			return self._hash
+		return Features._joinHashes([ (p, Features._hashProp(self.props[p]) if h is None else h)
+		                              for p, h in self._hash ])
+
+	@staticmethod
+	def _joinHashes(hs):
 		h = 0
-		for p in sorted(self.props.keys()):
-			inter = self.props[p]
-			if isinstance(inter, dict):
-				for p0 in sorted(inter.keys()):
-					h = hash((h, inter[p0]))
-			elif isinstance(inter, (list, set)):
-				h = hash((h, tuple(sorted(map(hash, inter)))))
-			else:
-				h = hash((h, inter))
+		for _, h0 in hs:
+			h = hash((h, h0))
 		return h
 
+	@staticmethod
+	def _hashProp(inter):
+		"""Return the hash of the value of a property in ``props``."""
+
+		if isinstance(inter, dict):
+			return hash(tuple(inter[p0] for p0 in sorted(inter.keys())))
+		elif isinstance(inter, (list, set)):
+			return hash(tuple(sorted(map(hash, inter))))
+		elif isinstance(inter, Feature) and isinstance(inter.value, Aspect):
+			# Hash references by id, as the aspect can change after caching
+			# the hash and ``check`` replaces the id by the aspect
+			return hash((inter.prop, inter.value.getId()))
+		return hash(inter)
+
+	@staticmethod
+	def _hasNested(inter):
+		"""Return whether the value of a property in ``props`` has nested features."""
+
+		if isinstance(inter, tuple):
+			return False
+		fs = inter.values() if isinstance(inter, dict) else inter if isinstance(inter, (list, set)) else (inter,)
+		return any(isinstance(f.value, Features) for f in fs)
+
+	def _getDigest(self):
+		"""
+		Return a digest of the features and the features that refer to other
+		aspects, also from the nested features.
+
+		The aspects referred are only identified by their class and id.
+		"""
+
+		if self._digest is None:
+			# Nested features can change without this knowing, so the properties
+			# with them are digested again on every call
+			parts = [ (p, None if Features._hasNested(self.props[p]) else Features._digestProp(p, self.props[p]))
+			          for p in sorted(self.props.keys()) ]
+			self._digest = parts if any(d is None for _, d in parts) else self._joinDigests(parts)
+		if not isinstance(self._digest, list):
+			return self._digest
+		return self._joinDigests([ (p, Features._digestProp(p, self.props[p]) if d is None else d)
+		                           for p, d in self._digest ])
+
+	def _joinDigests(self, parts):
+		h, refs = hashlib.sha1(), []
+		h.update(repr(type(self).__name__).encode("utf-8"))
+		for _, (data, refs0) in parts:
+			h.update(data)
+			refs.extend(refs0)
+		return (h.hexdigest(), tuple(refs))
+
+	@staticmethod
+	def _digestProp(p, inter):
+		"""
+		Return the text digested for a property in ``props`` and the features in
+		it that refer to other aspects.
+		"""
+
+		refs = []
+		token = lambda f: Features._token(f, refs)
+		if isinstance(inter, tuple):
+			tokens = [ token(f) for f in inter ]
+		elif isinstance(inter, dict):
+			tokens = [ token(inter[k]) for k in sorted(inter.keys()) ]
+		elif isinstance(inter, (list, set)):
+			tokens = sorted([ token(f) for f in inter ])
+		else:
+			tokens = [ token(inter) ]
+		return repr((p, tokens)).encode("utf-8"), refs
+
+	@staticmethod
+	def _token(f, refs):
+		"""
+		Return a string that identifies the feature ``f`` in ``_getDigest``, and
+		append to ``refs`` the features that refer to other aspects.
+		"""
+
+		if f is None:
+			return None
+		if isinstance(f.value, Aspect):
+			refs.append(f)
+			value = ("aspect", type(f.value).__name__, f.value.getId())
+		elif isinstance(f.value, Features):
+			digest, refs0 = f.value._getDigest()
+			refs.extend(refs0)
+			value = ("features", digest, getattr(f, "soft", None))
+		else:
+			value = f.value
+		return repr((f.prop, f.operator, value, f.unit))
+
+	def fingerprint(self):
+		"""
+		Return a digest of the content; the fingerprints of equal contents are equal.
+
+		The fingerprints of the aspects referred, like networks, are included, and
+		everything else is cached until the features change.
+		"""
+
+		digest, refs = self._getDigest()
+		if not refs:
+			return digest
+		h = hashlib.sha1(digest.encode("utf-8"))
+		for f in refs:
+			h.update(repr(f.value.fingerprint()).encode("utf-8"))
+		return h.hexdigest()
+
 	def diff(self, other):
 		"""
 		Return features in ``self`` whose value is different in ``other``.
@@ -284,11 +667,8 @@ class Features(object):
 			if isinstance(f.value, Features) and f.prop in other.props:
 				if f.operator == "=" or f.operator == "*=" or f.operator == ":=":
 					return f.value.diff(other.props[f.prop].value)
-				elif f.operator == "contains" and f.value.getKey() in other.props[f.prop]:
-					return f.value.diff(other.props[f.prop][f.value.getKey()].value)
-				elif f.operator == "contains" and f in other.props[f.prop]:
-					l = list(other.props[f.prop])
-					return f.value.diff(l[l.index(f)].value)
+			# Nested features in "contains" are kept whole, so the difference still
+			# says which of them changed
 			return f.getValue()
 		return [ Feature(f.prop, f.operator, diff0(f)) for f in diffs ]
 
@@ -304,9 +684,41 @@ class Features(object):
 			return False
 
 	def clone(self):
-		"""Return a copy of this aspect."""
+		"""
+		Return a copy of this aspect.
 
-		return copy.deepcopy(self)
+		The copy shares ``props`` with this until any of them is changed, so
+		change the values got from them only through methods like ``setValue``.
+		Nested features are changed through their own methods, so the copy gets
+		clones of them.
+		"""
+
+		c = copy.copy(self)
+		c._features, c._hash, c._numbered = self._features, self._hash, self._numbered
+		c._digest = self._digest
+		c._copyrefs = True
+		self._shared = c._shared = True
+		if any(isinstance(f.value, Features) for f in self.features):
+			c.props = dict((p, Features._cloneNested(inter) if Features._hasNested(inter) else inter)
+			               for p, inter in self.props.items())
+			c._features = c._numbered = None
+		return c
+
+	@staticmethod
+	def _cloneNested(inter):
+		"""Return a copy of the value of a property in ``props`` with clones of the nested features."""
+
+		def clone(f):
+			if isinstance(f, SoftFeatures):
+				return f.clone()
+			if isinstance(f.value, Features):
+				return Feature(f.prop, f.operator, f.value.clone(), f.unit, f.line)
+			return f
+		if isinstance(inter, dict):
+			return dict((k, clone(f)) for k, f in inter.items())
+		if isinstance(inter, (list, set)):
+			return type(inter)(clone(f) for f in inter)
+		return clone(inter)
 
 	def getId(self):
 		return self.getValue("id") if self.getValue("id") else self.getValue("name")
@@ -315,7 +727,7 @@ class Features(object):
 		return (str((self.getValue("class", self.__class__.__name__), self.getId()))
 		        if self.getId() is not None else None)
 
-	def addFeature(self, f, conflict="error", missing="other"):
+	def addFeature(self, f, conflict="error", missing="other", journal=None):
 		"""
 		Add a feature.
 
@@ -331,12 +743,16 @@ class Features(object):
 		   - ``"error"``: raise exception.
 		   - ``"ignore"``: do nothing.
 		   - ``"other"``: set the passed value.
+		- journal(_Journal): record the changes in it.
 		"""
 
 		OPTIONS_CONFLICT = ["error", "ignore", "me", "other"]
 		OPTIONS_MISSING = ["error", "ignore", "other"]
 		assert missing in OPTIONS_MISSING, "Invalid value in `missing`."
 		assert conflict in OPTIONS_CONFLICT, "Invalid value in `conflict`."
+		j = journal or _NO_JOURNAL
+		self._unshare(journal)
+		j.changed(self)
 
 		if f.prop not in self.props and missing == "error":
 			raise RADLConflict("Property has not set.", f1=f)
@@ -352,33 +768,34 @@ class Features(object):
 				inter1 = (f, None)
 			inter0 = self.props.get(f.prop, (None, None))
 			try:
-				self.props[f.prop] = Features._applyInter(inter0, inter1, conflict)
+				j.setitem(self.props, f.prop, Features._applyInter(inter0, inter1, conflict))
 			except Exception as e:
 				raise RADLConflict(str(e), f0=inter0, f1=f)
 		elif isinstance(f, SoftFeatures):
-			self.props.setdefault(f.prop, set()).add(f)
+			j.add(j.setdefault(self.props, f.prop, set()), f)
 		elif f.operator == "contains":
 			if hasattr(f.value, "getKey") and f.value.getKey() is not None:
 				if f.value.getKey() in self.props.get(f.prop, {}):
-					self.props[f.prop][f.value.getKey()].value.merge(f.value, conflict=conflict, missing=missing)
+					self.props[f.prop][f.value.getKey()].value.merge(f.value, conflict=conflict, missing=missing,
+					                                                 journal=journal)
 				else:
-					self.props.setdefault(f.prop, {})[f.value.getKey()] = f
+					j.setitem(j.setdefault(self.props, f.prop, {}), f.value.getKey(), f)
 			elif isinstance(self.props.get(f.prop, set()), set):
-				self.props.setdefault(f.prop, set()).add(f)
+				j.add(j.setdefault(self.props, f.prop, set()), f)
 			else:
 				raise RADLConflict("Conflict adding `%s` because `%s` is not a set, it is '%s'." % (f, f.prop, self.props[f.prop]))
 		elif isinstance(f.value, Aspect):
 			value0 = self.props.get(f.prop, None)
 			if not value0 or not value0.value or value0.value.getId() != f.value.getId():
-				self.props[f.prop] = f
+				j.setitem(self.props, f.prop, f)
 			else:
-				self.props[f.prop].value.merge(f.value, conflict=conflict, missing=missing)
+				self.props[f.prop].value.merge(f.value, conflict=conflict, missing=missing, journal=journal)
 		else:
 			value0 = self.props.get(f.prop, None)
 			if not value0 or (value0.value != f.value and
 					(conflict == "other" or f.operator == ":=" or
 					 (f.operator == "*=" and isinstance(f.value, str) and f.value.startswith(value0.value)))):
-				self.props[f.prop] = f
+				j.setitem(self.props, f.prop, f)
 				f.operator = "="
 			elif value0.value != f.value and conflict == "error":
 				raise RADLConflict("Conflict adding `%s` because `%s` is already set to `%s`." % (f, f.prop, value0.value), f0=value0, f1=f)
@@ -408,7 +825,9 @@ class Features(object):
 			if iftuple == "default":
 				return default
 			raise Exception("Getting value from a property with a constrain")
-		if isinstance(f, (list, set)):
+		if isinstance(f, set):
+			return [ toVal(v) for v in sorted_features(f) ]
+		if isinstance(f, list):
 			return [ toVal(v) for v in f ]
 		if isinstance(f, dict):
 			return [ toVal(v) for v in f.values() ]
@@ -425,6 +844,8 @@ class Features(object):
 	def setValue(self, prop, value, unit=None, operator="="):
 		"""Set the value of feature with that name."""
 
+		self._unshare()
+		self._changed()
 		if isinstance(value, (int, float)):
 			if prop in self.props:
 				for i, j in [(0, 1), (1, 0)]:
@@ -441,6 +862,8 @@ class Features(object):
 	def delValue(self, prop):
 		"""Remove the feature with that name."""
 
+		self._unshare()
+		self._changed()
 		try:
 			del self.props[prop]
 		except:
@@ -494,10 +917,12 @@ class Features(object):
 			raise Exception("Disjoint intervals!")
 		return None
 		
-	def merge(self, other, conflict="error", missing="error"):
+	def merge(self, other, conflict="error", missing="error", journal=None):
 		"""
 		Add the features in other to this.
 
+		If a conflict raises, this is left as it was before the call.
+
 		.. warning::
 		   Feature instances are only considered, that is, SoftFeatures will be
 		   not considered.
@@ -515,20 +940,26 @@ class Features(object):
 		   - ``"ignore"``: nothing.
 		   - ``"me"``: preserve the original value.
 		   - ``"other"``: set like the passed feature.
+		- journal(_Journal): record the changes in it, and leave the undoing to the caller.
 		"""
 
 		OPTIONS = ["error", "ignore", "me", "other"]
 		assert missing in OPTIONS, "Invalid value in `missing`."
 		assert conflict in OPTIONS, "Invalid value in `conflict`."
 
-		for self0 in (self.clone(), self):
+		j = journal or _Journal()
+		try:
 			for f in (other.features if isinstance(other, Features) else other):
-				self0.addFeature(f.clone(), conflict=conflict, missing=missing)
+				self.addFeature(f.clone(), conflict=conflict, missing=missing, journal=j)
+		except Exception:
+			if journal is None: j.rollback()
+			raise
 		return self
 
 	def check_simple(self, checks, radl):
 		"""Check types, operators and units in simple features."""
 
+		checks = compile_checks(checks)
 		for f in self.features:
 			if not isinstance(f, Feature) or f.prop not in checks: continue
 			f._check(checks[f.prop], radl)
@@ -545,19 +976,15 @@ class Features(object):
 		- radl: passed to ``_check_feature``.
 		"""
 	
+		checks = compile_checks(checks)
 		prefixes = {}
-		for f in self.features:
-			if not isinstance(f, Feature): continue
-			(prefix, sep, tail) = f.prop.partition(".")
-			if not sep or prefix not in checks: continue
+		for f, prefix, num, suffix in self._getNumbered()[0]:
+			if prefix not in checks: continue
 			checks0 = checks[prefix]
-			(num, sep, suffix) = tail.partition(".")
-			try:
-				num = int(num)
-			except:
+			if num is None:
 				raise RADLParseException(
 					"Invalid property name; expected an index.", line=f.line)
-			if not sep or suffix not in checks0: continue
+			if suffix not in checks0: continue
 			f._check(checks0[suffix], radl)
 			if prefix not in prefixes: prefixes[prefix] = set()
 			prefixes[prefix].add(num)
@@ -570,6 +997,47 @@ class Features(object):
 
 		return prefixes
 
+	def _getNumbered(self):
+		"""
+		Return the features with names like ``prefix.N.suffix``, as a list of
+		tuples (feature, prefix, N, suffix) in the order of ``features``, as a
+		dict {prefix: {N: {suffix: [feature, ...]}}} and a dict with the results
+		of ``getNumbered`` by prefix.
+		"""
+
+		if self._numbered is None:
+			flat, tree = [], {}
+			for f in self.features:
+				if not isinstance(f, Feature): continue
+				name = split_numbered_name(f.prop)
+				if name is None: continue
+				prefix, num, suffix = name
+				flat.append((f, prefix, num, suffix))
+				if num is not None and suffix is not None:
+					tree.setdefault(prefix, {}).setdefault(num, {}).setdefault(suffix, []).append(f)
+			self._numbered = (flat, tree, {})
+		return self._numbered
+
+	def getNumbered(self, prefix):
+		"""
+		Return the values of the properties ``prefix.N.suffix`` as a dict
+		{N: {suffix: value}} sorted by N, where value is like ``getValue`` with
+		``iftuple="default"``.
+
+		The result is cached until the features change, so do not modify it.
+		"""
+
+		_, tree, cache = self._getNumbered()
+		r = cache.get(prefix)
+		if r is None:
+			r = OrderedDict()
+			nums = tree.get(prefix, {})
+			for num in sorted(nums):
+				r[num] = dict((suffix, self.getValue(fs[0].prop, iftuple="default"))
+				              for suffix, fs in nums[num].items())
+			cache[prefix] = r
+		return r
+
 	def alternatives(self, other=None):
 		"""
 		Return a list of possible aspects sorted by its score.
@@ -581,22 +1049,50 @@ class Features(object):
 		Return(tuple): tuple of the resulting system and its score.
 		"""
 
-		new_system = self.clone().merge(other, missing="other") if other else self
+		for new_system, _ in self._soft_alternatives(other):
+			yield new_system
+
+	def _soft_alternatives(self, other=None, errors=RADLConflict):
+		"""
+		Return the results of merging every subset of the soft features and their scores.
+
+		Soft features are merged from the heaviest one, and the subsets are
+		yielded in the order of ``itertools.product([True, False], ...)``. The
+		subsets are walked depth-first: every merged prefix is cloned once and
+		shared by the subsets that start with it, and a prefix that raises one of
+		``errors`` discards all of them.
+		"""
+
+		new_system = self.clone()
+		if other:
+			new_system.merge(other, missing="other")
 		soft_features = sorted(self.getValue(SoftFeatures.SOFT, []), key=lambda f: f.soft, reverse=True)
-		masks = itertools.product([True, False], repeat=len(soft_features))
-		for mask in masks:
+		stack = [ (0, new_system, 0) ]
+		while stack:
+			i, new_system, score = stack.pop()
+			if i == len(soft_features):
+				yield new_system, score
+				continue
+			# Push the subsets without the i-th soft feature first, so they pop last
+			stack.append((i + 1, new_system, score))
 			try:
-				new_system0 = new_system.clone()
-				[ new_system0.merge(fs, missing="other")
-				  for m, fs in zip(mask, soft_features) if m ]
-			except RADLConflict:
+				new_system0 = new_system.clone().merge(soft_features[i], missing="other")
+			except errors:
 				pass
 			else:
-				yield new_system0
+				stack.append((i + 1, new_system0, score + soft_features[i].soft))
+
+_RENAMES = [0]
+"""Number of calls to ``setId``; ``_Aspects`` rebuilds its index by id when it changes."""
+
+def _renamed():
+	_RENAMES[0] += 1
 
 class Aspect:
 	"""Element in a RADL, like a network, system, deploy, configure or contextualize."""
 
+	__slots__ = ()
+
 	def getId(self):
 		"""Return the id of the aspect."""
 		return id(self)
@@ -647,23 +1143,155 @@ class Aspect:
 		#NOTE: Force operator '!=' be consistent to '=='
 		return not self.__eq__(other)
 
+	def fingerprint(self):
+		"""
+		Return a digest of the content, or None if it is not known.
+
+		Aspects with the same fingerprint are equal, so ``RADL.diff`` compares
+		them no further.
+		"""
+		return None
+
 	reference = False
 	"""Whether it is a reference for an aspect already defined."""
 
+	_frozen = False
+	"""Whether it is read-only; see ``FrozenAspect``."""
+
+	_thawed_class = None
+	"""If it is read-only, class of the aspect it was frozen from."""
+
 	__cmp__ = None
 
-def FrozenAspect(aspect):
-	"""Return a read-only aspect."""
+class _FrozenAspect(object):
+	"""
+	Methods of the classes of the read-only aspects made by ``FrozenAspect``.
 
-	assert isinstance(aspect, Aspect)
-	aspect = aspect.clone()
-	def ReadOnly(*_, **__):
+	Only the caches filled on reading can be set, so frozen aspects can be read
+	from several threads. ``clone`` returns an aspect that can be changed.
+
+	The methods are copied into a subclass of every aspect class, and not
+	inherited, so that an aspect can change its class in place.
+	"""
+
+	_CACHES = ("_features", "_hash", "_numbered", "_digest", "_outports", "_recipe_tree")
+	"""Attributes that can be set on a frozen aspect."""
+
+	_fingerprint = None
+	"""Value of ``fingerprint`` when the aspect was frozen."""
+
+	def _read_only(self, *_, **__):
 		raise NotImplementedError("Method not available.")
-	aspect.setId = aspect.merge = ReadOnly
+
+	setId = merge = _unshare = _relink = _read_only
+
+	def __setattr__(self, name, value):
+		if self._frozen and name not in _FrozenAspect._CACHES:
+			self._read_only()
+		object.__setattr__(self, name, value)
+
+	def __reduce__(self):
+		return (_freeze, (self.clone(),))
+
+	def fingerprint(self):
+		return self._fingerprint
+
+	def clone(self):
+		"""Return a copy that can be changed; it shares the content until it is changed."""
+
+		cls = self._thawed_class
+		c = cls.__new__(cls)
+		# Some aspects keep part of the state in slots, like ``SoftFeatures``
+		if hasattr(c, "__setstate__"):
+			c.__setstate__(dict((k, v) for k, v in self.__getstate__().items()
+			                    if k not in ("_frozen", "_fingerprint")))
+		if hasattr(c, "__dict__"):
+			# Also what ``__getstate__`` leaves out, like the caches
+			c.__dict__.update((k, v) for k, v in self.__dict__.items()
+			                  if k not in ("_frozen", "_fingerprint"))
+		if isinstance(c, Feature) and c.value is self:
+			c.value = c
+		return cls.clone(c)
+
+_FROZEN_CLASSES = {}
+"""Dict from the class of an aspect to the class of the frozen ones."""
+
+def _freeze(aspect):
+	"""Make read-only an aspect that is not in use elsewhere, and return it."""
+
+	cls = type(aspect)
+	frozen_cls = _FROZEN_CLASSES.get(cls)
+	if frozen_cls is None:
+		# Keep the name, as it is used in the keys and in the dumps
+		attrs = dict((k, v) for k, v in vars(_FrozenAspect).items()
+		             if k not in ("__dict__", "__weakref__", "__module__", "__doc__"))
+		attrs["_thawed_class"] = cls
+		frozen_cls = _FROZEN_CLASSES[cls] = type(cls.__name__, (cls,), attrs)
+	fingerprint = aspect.fingerprint()
+	# Fill now everything that is filled on reading, except the caches; the
+	# recipe text is kept, and it is decoded on the first read
+	if isinstance(aspect, configure) and aspect.recipe_text is None:
+		aspect.recipe_tree = aspect.recipe_tree
+	if isinstance(aspect, contextualize):
+		aspect.items = _FrozenDict(aspect.items)
+		if aspect.options is not None:
+			aspect.options = _FrozenDict(aspect.options)
+	if isinstance(aspect, Features):
+		# Nested features are changed through their own methods, so freeze them too
+		for f in aspect.features:
+			if (isinstance(f.value, Features) and not isinstance(f.value, Aspect) and
+			    f.value is not aspect and not f.value._frozen):
+				_freeze(f.value)
+		aspect._getNumbered()
+		aspect._getDigest()
+	if not isinstance(aspect, configure):
+		hash(aspect)
+	if hasattr(aspect, "__dict__"):
+		aspect.__class__ = frozen_cls
+	else:
+		# Slotted aspects, like deploy, do not take new attributes
+		frozen = frozen_cls.__new__(frozen_cls)
+		frozen.__setstate__(aspect.__getstate__())
+		aspect = frozen
+	aspect._fingerprint = fingerprint
+	aspect._frozen = True
 	return aspect
 
-class contextualize_item:
+class _FrozenDict(dict):
+	"""Read-only dict in a frozen aspect; its copies are plain dicts."""
+
+	def _read_only(self, *_, **__):
+		raise NotImplementedError("Method not available.")
+
+	__setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+	def __copy__(self):
+		return dict(self)
+
+	def __deepcopy__(self, memo):
+		return copy.deepcopy(dict(self), memo)
+
+	def __reduce__(self):
+		return (dict, (dict(self),))
+
+def FrozenAspect(aspect):
+	"""
+	Return a read-only aspect.
+
+	It shares the content with ``aspect``, which copies it only if it is changed
+	later. The hash and the fingerprint are computed once.
+	"""
+
+	assert isinstance(aspect, Aspect)
+	if aspect._frozen:
+		return aspect
+	return _freeze(aspect.clone())
+
+class contextualize_item(object):
 	"""Store a line under ``contextualize`` RADL keyword."""
+
+	__slots__ = ("system", "configure", "num", "line")
+
 	def __init__(self, system_id, configure_id, num=0, line=None):
 		self.system = system_id
 		"""System id."""
@@ -672,6 +1300,13 @@ class contextualize_item:
 		self.num = num
 		"""Num of steps (optional)."""
 		self.line = line
+
+	def __getstate__(self):
+		return dict((k, getattr(self, k)) for k in contextualize_item.__slots__)
+
+	def __setstate__(self, state):
+		for k, v in state.items():
+			setattr(self, k, v)
 		
 	def getId(self):
 		"""Return an unique key for this element."""
@@ -727,7 +1362,8 @@ class contextualize(Aspect, object):
 
 	def __hash__(self):
 		hash_elems = [ hash(self.items[k]) for k in sorted(self.items.keys()) ]
-		hash_elems.extend([ hash(self.options[k]) for k in sorted(self.options.keys()) ])
+		options = self.options or {}
+		hash_elems.extend([ hash(options[k]) for k in sorted(options.keys()) ])
 		return hash(tuple(hash_elems))
 
 	def __eq__(self, other):
@@ -742,12 +1378,15 @@ class contextualize(Aspect, object):
 	def __len__(self):
 		return len(self.items) + len(self.options)
 
-	def merge(self, cont, **kargs):
+	def merge(self, cont, journal=None, **kargs):
 		"""Update this instance with the contextualize passed."""
 
-		self.max_time = max(self.max_time, cont.max_time)
-		self.items.update(cont.items)
-		self.options.update(cont.options)
+		j = journal or _NO_JOURNAL
+		j.setattr(self, "max_time", max(self.max_time, cont.max_time))
+		for k, v in cont.items.items():
+			j.setitem(self.items, k, v)
+		for k, v in cont.options.items():
+			j.setitem(self.options, k, v)
 
 	def check(self, radl):
 		"""Check a contextualize."""
@@ -758,12 +1397,146 @@ class contextualize(Aspect, object):
 		for i in self.items.values():
 			i.check(radl)
 		
+_RECIPE_NODES = weakref.WeakValueDictionary()
+"""Recipe nodes alive by their exact content, to build every node only once."""
+
+class RecipeNode(object):
+	"""
+	Immutable list or dict in a recipe tree.
+
+	Nodes are hash-consed: building a node with the same items, in the same
+	order and with the same types, returns the existing node. So trees share
+	their equal subtrees, and the hash of every node is computed once.
+	"""
+
+	__slots__ = ("items", "hash", "__weakref__")
+
+	@classmethod
+	def make(cls, items):
+		"""Return the node with these items; they must be already frozen."""
+
+		items = tuple(items)
+		key = (cls, tuple((type(i), id(i) if isinstance(i, RecipeNode) else i) for i in cls._leaves(items)))
+		node = _RECIPE_NODES.get(key)
+		if node is None:
+			node = object.__new__(cls)
+			node.items = items
+			node.hash = cls._hash(items)
+			_RECIPE_NODES[key] = node
+		return node
+
+	def __reduce__(self):
+		return (type(self).make, (self.items,))
+
+	def __hash__(self):
+		return self.hash
+
+	def __eq__(self, other):
+		if self is other:
+			return True
+		return type(other) is type(self) and other.hash == self.hash and self._equal(other)
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	def __len__(self):
+		return len(self.items)
+
+	def __repr__(self):
+		return repr(thaw_recipe(self))
+
+class RecipeList(RecipeNode):
+	"""Immutable list in a recipe tree."""
+
+	__slots__ = ()
+
+	@staticmethod
+	def _leaves(items):
+		return items
+
+	@staticmethod
+	def _hash(items):
+		return hash(items)
+
+	def _equal(self, other):
+		return self.items == other.items
+
+	def __iter__(self):
+		return iter(self.items)
+
+	def __getitem__(self, i):
+		return self.items[i]
+
+	def __add__(self, other):
+		return RecipeList.make(self.items + other.items)
+
+class RecipeDict(RecipeNode):
+	"""Immutable dict in a recipe tree; ``items`` are (key, value) in insertion order."""
+
+	__slots__ = ("_dict",)
+
+	def _lookup(self):
+		try:
+			return self._dict
+		except AttributeError:
+			self._dict = dict(self.items)
+			return self._dict
+
+	@staticmethod
+	def _leaves(items):
+		return [ x for kv in items for x in kv ]
+
+	@staticmethod
+	def _hash(items):
+		return hash(frozenset(items))
+
+	def _equal(self, other):
+		return self._lookup() == other._lookup()
+
+	def __iter__(self):
+		return (k for k, _ in self.items)
+
+	def __contains__(self, key):
+		return key in self._lookup()
+
+	def __getitem__(self, key):
+		return self._lookup()[key]
+
+	def get(self, key, default=None):
+		return self._lookup().get(key, default)
+
+	def keys(self):
+		return [ k for k, _ in self.items ]
+
+def freeze_recipe(obj):
+	"""Return a recipe with lists and dicts replaced by ``RecipeList`` and ``RecipeDict``."""
+
+	if isinstance(obj, RecipeNode):
+		return obj
+	if isinstance(obj, list):
+		return RecipeList.make(freeze_recipe(i) for i in obj)
+	if isinstance(obj, dict):
+		return RecipeDict.make((k, freeze_recipe(v)) for k, v in obj.items())
+	return obj
+
+def thaw_recipe(obj):
+	"""Return a recipe with new lists and dicts instead of the nodes of a frozen recipe."""
+
+	if isinstance(obj, RecipeList):
+		return [ thaw_recipe(i) for i in obj.items ]
+	if isinstance(obj, RecipeDict):
+		return dict((k, thaw_recipe(v)) for k, v in obj.items)
+	return obj
+
 class configure(Aspect):
 	"""Store a RADL ``configure``."""
 
-	def __init__(self, name, recipe="", reference=False, line=None):
-		self.recipe = recipe
-		"""Recipe content."""
+	def __init__(self, name, recipe="", reference=False, line=None, recipe_text=None, recipe_line=None):
+		self._recipe = recipe
+		self.recipe_text = recipe_text
+		"""YAML text of the recipe while it has not been decoded, or None."""
+		self.recipe_line = recipe_line
+		"""Line where ``recipe_text`` starts."""
 		self.name = name
 		"""Configure id."""
 		self.reference = reference
@@ -775,37 +1548,135 @@ class configure(Aspect):
 
 	def setId(self, name):
 		self.name = name
+		_renamed()
 
 	def getKey(self):
 		return "configure", self.name
 
+	def _decode(self):
+		try:
+			return load_yaml(self.recipe_text)
+		except Exception as e:
+			raise RADLParseException("Error parsing YAML: %s" % str(e), line=self.recipe_line)
+
+	@property
+	def recipe(self):
+		"""
+		Recipe content; ``recipe_text`` is decoded on the first access.
+
+		The recipe can be changed in place, but read it again after the change
+		before comparing or hashing this configure.
+		"""
+
+		if self._frozen:
+			# The frozen recipe is shared, so every read gets its own copy
+			return thaw_recipe(self.recipe_tree)
+		if self._recipe_tree is not None:
+			self._recipe_tree = None
+		if self.recipe_text is not None:
+			self._recipe, self.recipe_text = self._decode(), None
+		elif self._tree is not None:
+			# The recipe can be changed in place, so it is a tree no longer
+			self._recipe, self._tree = thaw_recipe(self._tree), None
+		elif self._shared:
+			# The recipe can be changed in place, so share it no longer
+			self._recipe, self._shared = copy.deepcopy(self._recipe), False
+		return self._recipe
+
+	@recipe.setter
+	def recipe(self, recipe):
+		self._recipe, self.recipe_text, self._shared, self._tree = recipe, None, False, None
+		self._recipe_tree = None
+
+	@property
+	def recipe_tree(self):
+		"""
+		Recipe with ``RecipeList`` and ``RecipeDict`` instead of lists and dicts.
+
+		Clones and merges share the tree instead of copying the recipe.
+		"""
+
+		if self._tree is not None:
+			return self._tree
+		if self.recipe_text is not None:
+			# Keep the text, so comparing or hashing does not change the dumps nor
+			# the fingerprint, and cache the tree until the recipe is read or set
+			if self._recipe_tree is None:
+				self._recipe_tree = freeze_recipe(self._decode())
+			return self._recipe_tree
+		# The recipe may be changed in place after this, so keep it and cache its
+		# tree until it is read again
+		if self._recipe_tree is None:
+			self._recipe_tree = freeze_recipe(self._recipe)
+		return self._recipe_tree
+
+	@recipe_tree.setter
+	def recipe_tree(self, tree):
+		if isinstance(tree, RecipeNode):
+			self._recipe, self.recipe_text, self._shared, self._tree = None, None, False, tree
+			self._recipe_tree = None
+		else:
+			self.recipe = tree
+
+	def getRecipe(self):
+		"""Return the recipe like ``recipe``, but keep sharing it if it is a tree."""
+
+		return thaw_recipe(self._tree) if self._tree is not None else self.recipe
+
+	_tree = None
+	"""Recipe as a tree, or None if it is in ``_recipe`` or in ``recipe_text``."""
+
+	_shared = False
+	"""Whether the decoded recipe may be shared with a clone."""
+
+	_recipe_tree = None
+	"""
+	Tree built from ``_recipe`` or ``recipe_text`` by ``recipe_tree``, until
+	``recipe`` is read or set.
+	"""
+
+	def clone(self):
+		"""Return a copy of this configure that shares the recipe until it is read."""
+
+		c = copy.copy(self)
+		if self.recipe_text is None and isinstance(self._recipe, (list, dict)):
+			self._shared = c._shared = True
+		return c
+
 	def __eq__(self, other):
-		return other is not None and self.recipe == other.recipe
+		return other is not None and self.recipe_tree == other.recipe_tree
+
+	def fingerprint(self):
+		# The decoded recipe can be changed in place, so only the text is digested
+		if self.recipe_text is None:
+			return None
+		return hashlib.sha1(repr(("configure", self.recipe_text)).encode("utf-8")).hexdigest()
 
 	def __hash__(self):
-		return configure._hash_yaml(self.recipe)
+		return hash(self.recipe_tree)
 
 	def __repr__(self):
-		return ("configure(%s, %s)" % (self.name, self.recipe) if not self.reference
+		return ("configure(%s, %s)" % (self.name, self.recipe_tree) if not self.reference
 		        else "configure(%s, reference=True)" % self.name)
 
-	@staticmethod
-	def _hash_yaml(obj):
-		if isinstance(obj, dict):
-			return reduce(lambda h, p: hash((h, p, configure._hash_yaml(obj[p]))),
-			              sorted(obj.keys()), 0)
-		elif isinstance(obj, list):
-			return reduce(lambda h, p: hash((h, configure._hash_yaml(p))), obj, 0)
-		else:
-			return hash(obj)
-
-	def merge(self, other, conflict="error", missing="other"):
+	def merge(self, other, conflict="error", missing="other", journal=None):
 		OPTIONS_CONFLICT = ["error", "ignore", "me", "other"]
 		OPTIONS_MISSING = ["error", "ignore", "other"]
 		assert missing in OPTIONS_MISSING, "Invalid value in `missing`."
 		assert conflict in OPTIONS_CONFLICT, "Invalid value in `conflict`."
 
-		self.recipe = copy.deepcopy(configure._merge_yaml(self.recipe, other.recipe, conflict, missing))
+		# The trees are immutable, so the result shares them instead of copying them
+		recipe = configure._merge_yaml(self.recipe_tree, other.recipe_tree, conflict, missing)
+		j = journal or _NO_JOURNAL
+		if isinstance(recipe, RecipeNode):
+			j.setattr(self, "_tree", recipe)
+			j.setattr(self, "_recipe", None)
+		else:
+			j.setattr(self, "_tree", None)
+			j.setattr(self, "_recipe", recipe)
+		j.setattr(self, "recipe_text", None)
+		j.setattr(self, "_shared", False)
+		j.setattr(self, "_recipe_tree", None)
 
 	@staticmethod
 	def _merge_yaml(me, other, conflict="error", missing="other"):
@@ -815,25 +1686,27 @@ class configure(Aspect):
 			if conflict == "ignore": return me
 			return meother(me, other) if conflict == "me" else meother(other, me)
 		if me == other: return me
-		if not any([ isinstance(me, t) and isinstance(other, t) for t in (list, dict) ]):
+		if not any([ isinstance(me, t) and isinstance(other, t) for t in (RecipeList, RecipeDict) ]):
 			return resolv()
-		if isinstance(me, list): return resolv(lambda x,y: y+x)
+		if isinstance(me, RecipeList): return resolv(lambda x,y: y+x)
 		if missing == "error":
 			for p in other.keys():
 				if not p in me: raise RADLConflict("Key '%s' not in '%s'" % (p, me))
-		r = dict(other) if missing == "other" else {}
+		r = OrderedDict(other.items) if missing == "other" else OrderedDict()
 		r.update([ (p, configure._merge_yaml(v, other[p], conflict, missing))
-                           if p in other else (p, v) for p,v in me.items() ])
-		return r
+                           if p in other else (p, v) for p,v in me.items ])
+		return RecipeDict.make(r.items())
 	
 	def check(self, _):
 		"""Check this configure."""
 
 		return True
 
-class deploy(Aspect):
+class deploy(Aspect, object):
 	"""Store a RADL ``deploy``."""
 
+	__slots__ = ("id", "vm_number", "cloud_id", "line")
+
 	def __init__(self, id, vm_number, cloud_id=None, line=None):
 		self.id = id
 		"""System id."""
@@ -842,6 +1715,13 @@ class deploy(Aspect):
 		self.cloud_id = cloud_id
 		"""Cloud provider id."""
 		self.line = line
+
+	def __getstate__(self):
+		return dict((k, getattr(self, k)) for k in deploy.__slots__)
+
+	def __setstate__(self, state):
+		for k, v in state.items():
+			setattr(self, k, v)
 		
 	def __eq__(self, other):
 		return id(self) == id(other)
@@ -849,6 +1729,9 @@ class deploy(Aspect):
 	def __hash__(self):
 		return id(self)
 
+	def clone(self):
+		return deploy(self.id, self.vm_number, self.cloud_id, self.line)
+
 	def merge(self, aspect, **kargs):
 		if self != aspect:
 			raise Exception("Don't do this!")
@@ -879,13 +1762,18 @@ class FeaturedAspect(Features, Aspect):
 
 	def setId(self, id):
 		self.id = id
+		_renamed()
 
 	def __eq__(self, other):
-		return isinstance(other, type(self)) and Features.__eq__(self, other)
+		return isinstance(other, self._thawed_class or type(self)) and Features.__eq__(self, other)
+
+	# Defining __eq__ drops the inherited __hash__ in Python 3
+	__hash__ = Features.__hash__
 
 	def diff(self, other):
-		assert isinstance(other, type(self))
-		return type(self)(self.id, Features.diff(self, other))
+		cls = self._thawed_class or type(self)
+		assert isinstance(other, cls)
+		return cls(self.id, Features.diff(self, other))
 
 	def __repr__(self):
 		return "{cls}({id}, {fs}, reference={r}, line={l})".format(
@@ -894,15 +1782,24 @@ class FeaturedAspect(Features, Aspect):
 	def __str__(self):
 		return repr(self)
 
-class outport():
+class outport(object):
 	"""Store OutPorts data"""
 
+	__slots__ = ("port_init", "port_end", "protocol", "range")
+
 	def __init__(self, port_init, port_end, protocol, range=False):
 		self.port_init = int(port_init)
 		self.port_end = int(port_end)
 		self.protocol = protocol
 		self.range = range
 
+	def __getstate__(self):
+		return dict((k, getattr(self, k)) for k in outport.__slots__)
+
+	def __setstate__(self, state):
+		for k, v in state.items():
+			setattr(self, k, v)
+
 	def __eq__(self, other):
 		return (self.port_init == other.port_init and self.port_end == other.port_end
 				and self.protocol == other.protocol and self.range == other.range)
@@ -992,13 +1889,22 @@ class outport():
 class network(FeaturedAspect):
 	"""Store a RADL ``network``."""
 
+	SIMPLE_FEATURES = compile_checks({
+		"outbound": (str, ["YES", "NO"])
+	})
+
+	_outports = None
+	"""Cached value of ``_parseOutPorts``."""
+
+	def __getstate__(self):
+		state = Features.__getstate__(self)
+		state.pop("_outports", None)
+		return state
+
 	def check(self, radl):
 		"""Check the features in this network."""
 
-		SIMPLE_FEATURES = {
-			"outbound": (str, ["YES", "NO"])
-		}
-		self.check_simple(SIMPLE_FEATURES, radl)
+		self.check_simple(self.SIMPLE_FEATURES, radl)
 
 	def isPublic(self):
 		"""Return true if outbound = yes."""
@@ -1010,11 +1916,44 @@ class network(FeaturedAspect):
 		outports format: 22/tcp-22/tcp,8899/tcp,8800
 		Returns a list of outport objects
 		"""
-		outports = self.getValue("outports")
-		if outports:
-			return outport.parseOutPorts(outports)
-		else:
-			return None
+		outports = self._parseOutPorts()[1]
+		return list(outports) if outports else None
+
+	def _parseOutPorts(self):
+		"""
+		Return a tuple with the value of ``outports``, the list of outport objects,
+		a dict {(local port, protocol): remote port} and the list of port ranges.
+
+		The result is cached while ``outports`` keeps the same value.
+		"""
+
+		value = self.getValue("outports")
+		if self._outports is None or self._outports[0] != value:
+			outports = outport.parseOutPorts(value) if value else []
+			ports, ranges = {}, []
+			for p in outports:
+				if p.is_range():
+					ranges.append(p)
+				else:
+					ports[(p.get_local_port(), p.get_protocol())] = p.get_remote_port()
+			self._outports = (value, outports, ports, ranges)
+		return self._outports
+
+	def getRemotePort(self, port, protocol="tcp", default=None):
+		"""
+		Return the remote port mapped to the local ``port``, or ``default``.
+
+		The ports in a range are mapped to themselves. If several outports map
+		the same port, the last one is used.
+		"""
+
+		_, _, ports, ranges = self._parseOutPorts()
+		if (port, protocol) in ports:
+			return ports[(port, protocol)]
+		for p in ranges:
+			if p.get_protocol() == protocol and p.get_port_init() <= port <= p.get_port_end():
+				return port
+		return default
 
 class FeaturesApp(Features):
 	"""Store an RADL application."""
@@ -1022,22 +1961,24 @@ class FeaturesApp(Features):
 	def __init__(self, features):
 		Features.__init__(self, features)
 
+	@staticmethod
+	def _check_version(version, _):
+		if version.value == "":
+			return True
+		else:
+			return all([num.isdigit() for num in version.value.split(".")])
+
+	SIMPLE_FEATURES = compile_checks({
+		"name": (str, True),
+		"path": (str, True),
+		"version": (str, lambda f, r: FeaturesApp._check_version(f, r)),
+		"preinstalled": (str, ["YES", "NO"])
+	})
+
 	def check(self, radl):
 		"""Check the features in this application."""
 
-		def is_version(version, _):
-			if version.value == "":
-				return True
-			else:
-				return all([num.isdigit() for num in version.value.split(".")])
-
-		SIMPLE_FEATURES = {
-			"name": (str, True),
-			"path": (str, True),
-			"version": (str, is_version),
-			"preinstalled": (str, ["YES", "NO"])
-		}
-		self.check_simple(SIMPLE_FEATURES, radl)
+		self.check_simple(self.SIMPLE_FEATURES, radl)
 
 class _system(Features):
 	"""
@@ -1048,6 +1989,16 @@ class _system(Features):
 	- ``state`` = ``unknown``, ``running``, ``stopped``, ``deleted``
 	"""
 
+	def interfaces(self):
+		"""Return the features of the ``net_interface.N`` as a dict {N: {suffix: value}}."""
+
+		return self.getNumbered("net_interface")
+
+	def disks(self):
+		"""Return the features of the ``disk.N`` as a dict {N: {suffix: value}}."""
+
+		return self.getNumbered("disk")
+
 	UNKNOWN = "unknown"
 	PENDING = "pending"
 	RUNNING = "running"
@@ -1059,64 +2010,71 @@ class _system(Features):
 	UNKNOWN = "unknown"
 	IS_ACCESSIBLE = frozenset(("pending", "running", "stopped", "configured", "failed", "unconfigured"))
 
+	@staticmethod
+	def _check_positive(f, _):
+		return f.value >= 0
+
+	@staticmethod
+	def _check_net_interface_connection(f, radl):
+		return not isinstance(f.value, str) or bool(radl.get(network(f.value)))
+
+	@staticmethod
+	def _check_app(f, radl):
+		FeaturesApp(f.value.features).check(radl)
+		return True
+
+	_MEM_UNITS = [None, "", "B", "K", "M", "G", "KB", "MB", "GB"]
+
+	SIMPLE_FEATURES = compile_checks({
+		"image_type": (str, ["VMDK", "QCOW", "QCOW2", "RAW"]),
+		"virtual_system_type": (str, lambda f, r: system._check_virtual_system_type(f, r)),
+		"price": ((int,float), lambda f, r: _system._check_positive(f, r), None),
+		"cpu.count": (int, lambda f, r: _system._check_positive(f, r), None),
+		"cpu.arch": (str, ['I386', 'X86_64']),
+		"cpu.performance": ((int,float), lambda f, r: _system._check_positive(f, r), ["ECU", "GCEU", "HRZ"]),
+		"memory.size": ((int,float), lambda f, r: _system._check_positive(f, r), _MEM_UNITS)
+	})
+	"""Checks of the simple features; the one of ``SoftFeatures.SOFT`` is added after that class."""
+
+	NUM_FEATURES = compile_checks({
+		"net_interface": {
+			"connection": ((str,Aspect), lambda f, r: _system._check_net_interface_connection(f, r)),
+			"dns_name": (str, None) },
+		"disk": {
+			"image.url": (str, lambda f, r: system._check_disk_image_url(f, r)),
+			"image.name": (str, None),
+			"type": (str, None),
+			"device": (str, None),
+			"size": (int, lambda f, r: _system._check_positive(f, r), _MEM_UNITS),
+			"free_size": (int, lambda f, r: _system._check_positive(f, r), _MEM_UNITS),
+			"os.name": (str, ["LINUX", "WINDOWS", "MAC OS X"]),
+			"os.flavour": (str, None),
+			"os.version": (str, None),
+			"os.credentials.username": (str, None),
+			"os.credentials.password": (str, None),
+			"os.credentials.private_key": (str, None),
+			"os.credentials.public_key": (str, None),
+			"applications": (Features, lambda f, r: _system._check_app(f, r))
+		}
+	})
+
 	def check(self, radl):
 		"""Check the features in this system."""
 
-		def positive(f, _):
-			return f.value >= 0
-
-		mem_units = [None, "", "B", "K", "M", "G", "KB", "MB", "GB"]
-		SIMPLE_FEATURES = {
-			"image_type": (str, ["VMDK", "QCOW", "QCOW2", "RAW"]),
-			"virtual_system_type": (str, system._check_virtual_system_type),
-			"price": ((int,float), positive, None),
-			"cpu.count": (int, positive, None),
-			"cpu.arch": (str, ['I386', 'X86_64']),
-			"cpu.performance": ((int,float), positive, ["ECU", "GCEU", "HRZ"]),
-			"memory.size": ((int,float), positive, mem_units),
-			SoftFeatures.SOFT: (SoftFeatures, lambda x, r: x.check(r))
-		}
-		self.check_simple(SIMPLE_FEATURES, radl)
+		self.check_simple(self.SIMPLE_FEATURES, radl)
+		prefixes = self.check_num(self.NUM_FEATURES, radl)
 
-		net_connections = set()
-		def check_net_interface_connection(f, radl0):
+		# Replace the names of the networks by the network objects
+		interfaces = self._getNumbered()[1].get("net_interface", {})
+		connections = [ fs["connection"][0] for fs in interfaces.values() if "connection" in fs ]
+		for f in connections:
 			if isinstance(f.value, str):
-				net = radl0.get(network(f.value))
-				if not net:
-					return False
-				f.value = net
-			net_connections.add(f.prop)
-			return True
-
-		def check_app(f, x):
-			FeaturesApp(f.value.features).check(x)
-			return True
-	
-		NUM_FEATURES = {
-			"net_interface": {
-				"connection": ((str,Aspect), check_net_interface_connection),
-				"dns_name": (str, None) },
-			"disk": {
-				"image.url": (str, system._check_disk_image_url),
-				"image.name": (str, None),
-				"type": (str, None),
-				"device": (str, None),
-				"size": (int, positive, mem_units),
-				"free_size": (int, positive, mem_units),
-				"os.name": (str, ["LINUX", "WINDOWS", "MAC OS X"]),
-				"os.flavour": (str, None),
-				"os.version": (str, None),
-				"os.credentials.username": (str, None),
-				"os.credentials.password": (str, None),
-				"os.credentials.private_key": (str, None),
-				"os.credentials.public_key": (str, None),
-				"applications": (Features, check_app)
-			}
-		}
-		prefixes = self.check_num(NUM_FEATURES, radl)
+				self._unshare()
+				self.props[f.prop].value = radl.get(network(f.value))
+				self._changed()
 
 		# Check all interfaces
-		if len(net_connections) != len(prefixes.get("net_interface", set())):
+		if len(connections) != len(prefixes.get("net_interface", set())):
 			raise RADLParseException( "Some net_interface does not have a connection")
 
 		return True
@@ -1183,17 +2141,8 @@ class _system(Features):
 		Return(tuple): tuple of the resulting system and its score.
 		"""
 
-		new_system = self.clone()
-		if other:
-			new_system.merge(other, missing="other")
-		soft_features = self.getValue(SoftFeatures.SOFT, [])
-		score = 0
-		for f in sorted(soft_features, key=lambda f: f.soft, reverse=True):
-			try:
-				new_system.merge(f, missing="other")
-				score += f.soft
-			except:
-				pass
+		# The first alternative merges greedily every soft feature that fits
+		new_system, score = next(self._soft_alternatives(other, errors=Exception))
 		new_system.delValue(SoftFeatures.SOFT)
 		return new_system, score
 
@@ -1231,6 +2180,20 @@ class SoftFeatures(_system, Feature):
 	def __hash__(self):
 		return _system.__hash__(self)
 
+	def clone(self):
+		# The feature value is the object itself, so point it to the copy
+		c = Features.clone(self)
+		c.value = c
+		return c
+
+	def __getstate__(self):
+		state = Features.__getstate__(self)
+		state.update(Feature.__getstate__(self))
+		return state
+
+	def __setstate__(self, state):
+		Feature.__setstate__(self, state)
+
 	def __eq__(self, other):
 		return isinstance(other, SoftFeatures) and Features.__eq__(self, other)
 
@@ -1238,6 +2201,8 @@ class SoftFeatures(_system, Feature):
 		assert isinstance(other, SoftFeatures)
 		return SoftFeatures(self.soft, Features.diff(self, other))
 
+_system.SIMPLE_FEATURES[SoftFeatures.SOFT] = FeatureCheck((SoftFeatures, lambda x, r: x.check(r)))
+
 class Infrastructure(FeaturedAspect):
 	"""
 	Store an infrastructure.
@@ -1300,11 +2265,104 @@ class DeployScript(FeaturedAspect):
 	IS_ACCESSIBLE = frozenset(("ready", "pending"))
 
 
+class _Aspects(OrderedDict):
+	"""
+	Aspects of a RADL by key, also indexed by class and by id.
+
+	The indexes are updated on every insertion and removal, so ``RADL.gets``
+	does not scan the whole document.
+	"""
+
+	def __init__(self, items=()):
+		self.by_class = {}
+		"""Dict from the class of the aspects to an OrderedDict of them by key."""
+
+		self.by_id = {}
+		"""Dict from the id of the aspects to an OrderedDict of them by key."""
+
+		self._index = {}
+		"""Dict from key to the (class, id) the aspect was indexed with."""
+
+		self._renames = _RENAMES[0]
+		"""Value of ``_RENAMES`` when ``by_id`` was last valid."""
+
+		OrderedDict.__init__(self, items)
+
+	def __reduce__(self):
+		return (self.__class__, (list(self.items()),))
+
+	def __setitem__(self, key, value):
+		new = (value.__class__, value.getId())
+		old = self._index.get(key)
+		if old is None:
+			OrderedDict.__setitem__(self, key, value)
+			self._index[key] = new
+			self.by_class.setdefault(new[0], OrderedDict())[key] = value
+			self.by_id.setdefault(new[1], OrderedDict())[key] = value
+			return
+		# Replace the aspect keeping its position in the document and in the indexes
+		OrderedDict.__setitem__(self, key, value)
+		self._index[key] = new
+		for index, k0, k in ((self.by_class, old[0], new[0]), (self.by_id, old[1], new[1])):
+			if k == k0:
+				index[k0][key] = value
+				continue
+			del index[k0][key]
+			if not index[k0]: del index[k0]
+			index[k] = OrderedDict((k1, v) for k1, v in self.items()
+			                       if k1 in index.get(k, ()) or k1 == key)
+
+	def ids(self):
+		"""Return ``by_id``, rebuilt if some aspect has changed its id since it was built."""
+
+		if self._renames != _RENAMES[0]:
+			self.by_id = {}
+			for key, value in self.items():
+				cls, id = self._index[key] = (value.__class__, value.getId())
+				self.by_id.setdefault(id, OrderedDict())[key] = value
+			self._renames = _RENAMES[0]
+		return self.by_id
+
+	def __delitem__(self, key):
+		OrderedDict.__delitem__(self, key)
+		self._unindex(key)
+
+	def _unindex(self, key):
+		if key not in self._index: return
+		cls, id = self._index.pop(key)
+		for index, k in ((self.by_class, cls), (self.by_id, id)):
+			del index[k][key]
+			if not index[k]: del index[k]
+
+	def pop(self, key, *default):
+		if key not in self:
+			return OrderedDict.pop(self, key, *default)
+		value = self[key]
+		del self[key]
+		return value
+
+	def popitem(self, last=True):
+		if not self:
+			raise KeyError("dictionary is empty")
+		key = next(reversed(self)) if last else next(iter(self))
+		return key, self.pop(key)
+
+	def clear(self):
+		OrderedDict.clear(self)
+		self.by_class, self.by_id, self._index = {}, {}, {}
+		self._renames = _RENAMES[0]
+
 class RADL(object):
 	"""Parsed RADL document."""
+
+	_deferred = 0
+	"""Number of nested ``deferred_checks`` blocks running."""
+
+	_pending = False
+	"""Whether a check was deferred."""
 	
 	def __init__(self, aspects=[], ifpresent="error", check=True, **kwargs):
-		self.props = OrderedDict()
+		self.props = _Aspects()
 		"""Dict of aspects with key (type, id)."""
 
 		for a in aspects:
@@ -1322,15 +2380,22 @@ class RADL(object):
 		return "RADL([ %s ])" % ", ".join(map(repr, self.props.values()))
 
 	def __hash__(self):
-		return hash(tuple([ self.props[k] for k in sorted(self.props.keys()) ]))
+		return hash(tuple([ self.props[k] for k in sorted(self.props.keys(), key=str) ]))
 
 	def __eq__(self, other):
 		return other is not None and isinstance(other, RADL) and self.props == other.props
 
-	def add(self, aspect, ifpresent="error", check=False, addaspects=True, **kwargs):
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		if not isinstance(self.props, _Aspects):
+			self.props = _Aspects(self.props.items())
+
+	def add(self, aspect, ifpresent="error", check=False, addaspects=True, journal=None, **kwargs):
 		"""
 		Add an aspect.
 
+		If a conflict raises, this is left as it was before the call.
+
 		Args:
 		- aspect(Aspect): thing to add.
 		- ifpresent(str): if it has been defined, do:
@@ -1340,6 +2405,7 @@ class RADL(object):
 		   - ``"merge"``: apply new aspect features to the old aspect.
 		   - ``"error"``: raise an error.
                 - addaspects: add also aspects in features.
+		- journal(_Journal): record the changes in it, and leave the undoing to the caller.
 		- conflict, missing: args passed to ``merge`` if ``ifpresent`` is ``"merge"``.
 
 		Return(bool): True if aspect was added.
@@ -1349,35 +2415,47 @@ class RADL(object):
 		assert ifpresent in OPTIONS_IFPRESENT, "Invalid value in `ifpresent`."
 		assert isinstance(aspect, Aspect)
 
+		j = journal or _Journal()
+		try:
+			r = self._add(aspect, ifpresent, check, addaspects, j, kwargs)
+		except Exception:
+			if journal is None: j.rollback()
+			raise
+		if check and addaspects: self._check_now()
+		return r
+
+	def _add(self, aspect, ifpresent, check, addaspects, j, kwargs):
 		aspect0 = self.props.get(aspect.getKey(), None)
 		if aspect0 and aspect.reference:
 			return False
 		if aspect0 and aspect0.reference:
-			aspect0.merge(aspect, conflict="other", missing="other")
-			aspect0.reference = False
+			aspect0.merge(aspect, conflict="other", missing="other", journal=j)
+			j.setattr(aspect0, "reference", False)
 			aspect = aspect0
 		elif aspect0 and id(aspect0) != id(aspect):
 			# If some aspect with the same id is found
 			if ifpresent == "error":
 				raise Exception("Aspect with the same id was found: `%s`." % str(aspect.getKey()))
 			elif ifpresent == "merge":
-				aspect0.merge(aspect, **kwargs)
+				aspect0.merge(aspect, journal=j, **kwargs)
 			elif ifpresent == "ignore":
 				return False
 		else:
-			aspect0 = self.props[aspect.getKey()] = aspect
+			aspect0 = aspect
+			j.setitem(self.props, aspect.getKey(), aspect)
 		aspect = aspect0
 
 		# Otherwise add aspect
 		if addaspects and isinstance(aspect, Features):
 			fs = [f for f in aspect.features if isinstance(f.value, Aspect) and
 			      id(self.get(f.value)) != id(f.value) ]
-			for self0, i in ((self.clone(check=False), 0), (self, 1)):
-				for f in fs:
-					self0.add(f.value, ifpresent=ifpresent, check=check, **kwargs)
-					if i == 1: f.value = self0.get(f.value)
-
-		if check and addaspects: self.check()
+			if fs and aspect._shared:
+				aspect._unshare(j)
+				fs = [f for f in aspect.features if isinstance(f.value, Aspect) and
+				      id(self.get(f.value)) != id(f.value) ]
+			for f in fs:
+				self._add(f.value, ifpresent, check, addaspects, j, kwargs)
+				j.setattr(f, "value", self.get(f.value))
 		return True
 
 	def delete(self, aspect, ifnotpresent="error"):
@@ -1403,7 +2481,7 @@ class RADL(object):
 			elif ifnotpresent == "ignore":
 				return False
 		del self.props[aspect.getKey()]
-		self.check()
+		self._check_now()
 
 	
 	def merge(self, radl, ifpresent="merge", cls=None, **kwargs):
@@ -1424,11 +2502,15 @@ class RADL(object):
 		Return(bool): True if aspect was added.
 		"""
 
-		for self0 in (self.clone(check=False), self):
+		j = _Journal()
+		try:
 			for aspect in radl.aspects:
 				if cls and not isinstance(aspect, cls): continue
-				self0.add(aspect, ifpresent, **kwargs)
-		self.check()
+				self.add(aspect, ifpresent, journal=j, **kwargs)
+		except Exception:
+			j.rollback()
+			raise
+		self._check_now()
 		return True
 
 	def get(self, aspect, default=None):
@@ -1437,28 +2519,76 @@ class RADL(object):
 		aspectkey = aspect.getKey() if isinstance(aspect, Aspect) else aspect
 		return self.props.get(aspectkey, default)
 
-	def gets(self, cls):
-		"""Return a list of aspects of that type."""
+	def gets(self, cls, id=None):
+		"""Return a list of aspects of that type, and with that id if it is passed."""
+
+		if id is not None:
+			return [ a for a in self.props.ids().get(id, {}).values() if isinstance(a, cls) ]
+		classes = [ c for c in self.props.by_class if issubclass(c, cls) ]
+		if len(classes) > 1:
+			return [ a for a in self.aspects if isinstance(a, cls) ]
+		return list(self.props.by_class[classes[0]].values()) if classes else []
+
+	def public_network(self):
+		"""Return the last network with ``outbound = 'yes'``, or None."""
 
-		return [ a for a in self.aspects if isinstance(a, cls) ]
+		public = None
+		for net in self.gets(network):
+			if net.isPublic():
+				public = net
+		return public
 
 	def diff(self, other):
+		"""
+		Return a RADL with the aspects that are not in ``other`` or are different,
+		and for aspects with features, only the different features.
+
+		Aspects with the same ``fingerprint`` are skipped without comparing them.
+		The result is not checked, as it may refer to aspects that did not change.
+		"""
+
 		assert isinstance(other, RADL)
-		return RADL([ (a.diff(other.get(a)) if other.get(a) and a.diff else a)
-		              for a in self.aspects if a != other.get(a) ], ifpresent="merge",
-		            missing="other")
+		def changed(a, a0):
+			if a0 is not None:
+				fingerprint = a.fingerprint()
+				if fingerprint is not None and fingerprint == a0.fingerprint():
+					return False
+			return a != a0
+		def diff(a, a0):
+			try:
+				return a.diff(a0)
+			except NotImplementedError:
+				# Like configure, send the whole aspect
+				return a
+		return RADL([ (diff(a, other.get(a)) if other.get(a) else a)
+		              for a in self.aspects if changed(a, other.get(a)) ], ifpresent="merge",
+		            check=False, missing="other")
 
 	def clone(self, check=True):
-		r = RADL()
+		return self._clone(RADL(), check)
+
+	def _clone(self, r, check):
 		for a in self.aspects:
 			new_a = a.clone()
 			r.props[new_a.getKey()] = new_a
 		for a in r.aspects:
-			for f in (a.features if isinstance(a, Features) else []):
-				if isinstance(f.value, Aspect):
-					f.value = r.get(f.value)
+			if isinstance(a, Features): a._relink(r)
 		if check: r.check()
 		return r
+
+	def freeze(self):
+		"""
+		Return a read-only snapshot of this RADL; see ``FrozenRADL``.
+
+		The snapshot shares the features and recipes with this RADL, which copies
+		them only if it is changed later. Check the RADL before freezing it, as
+		checking may complete the aspects.
+		"""
+
+		r = self._clone(FrozenRADL(), False)
+		for k, a in list(r.props.items()):
+			r.props[k] = _freeze(a)
+		return r
 	
 	def check(self):
 		"""Check if it is a valid RADL document."""
@@ -1467,6 +2597,68 @@ class RADL(object):
 			i.check(self)
 		return True
 
+	def _check_now(self):
+		"""Check after a change, unless the checks are deferred."""
+
+		if self._deferred:
+			self._pending = True
+		else:
+			self.check()
+
+	@contextmanager
+	def deferred_checks(self):
+		"""
+		Check the document once at the end of the block, and not after every
+		``add``, ``delete`` or ``merge`` done in it.
+
+		The check is skipped if the block raises. Blocks can be nested; the
+		outermost one does the check.
+		"""
+
+		self._deferred += 1
+		try:
+			yield self
+		finally:
+			self._deferred -= 1
+			pending = self._pending
+			if not self._deferred: self._pending = False
+		if pending and not self._deferred:
+			self.check()
+
+class FrozenRADL(RADL):
+	"""
+	Read-only RADL returned by ``RADL.freeze``.
+
+	The aspects are frozen (see ``FrozenAspect``) and the hashes and fingerprints
+	are computed once, so several threads can read the same RADL without copying
+	it. ``thaw`` returns a RADL that can be changed.
+	"""
+
+	_hash = None
+	"""Cached value of ``__hash__``."""
+
+	def _read_only(self, *_, **__):
+		raise NotImplementedError("Method not available.")
+
+	add = delete = merge = _read_only
+
+	def __hash__(self):
+		# Computed on the first call, as it decodes the recipes
+		if self._hash is None:
+			self._hash = RADL.__hash__(self)
+		return self._hash
+
+	def __reduce__(self):
+		return (RADL.freeze, (self.thaw(),))
+
+	def freeze(self):
+		return self
+
+	def thaw(self):
+		"""Return a RADL that can be changed; it shares the content until it is changed."""
+
+		return self.clone(check=False)
+
 # NOTE: deprecated
 class Application:
 	pass
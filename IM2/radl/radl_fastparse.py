@@ -0,0 +1,461 @@
+# radl_fastparse - Hand-written parser for RADL.
+# Copyright (C) 2014 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Single-pass RADL parser that does not depend on PLY.
+
+It accepts the grammar of ``radl_parse.RADLParser`` and builds the same
+objects, with the same line numbers. The lexer follows the PLY states one by
+one, except that a ``@begin ... @end`` block is returned as a single
+``RECIPE`` token instead of a ``RECIPE_LINE`` token per line. The input may
+come in pieces, so ``parse_radl_iter`` can read files and HTTP responses
+while the aspects are yielded.
+"""
+
+import re
+import codecs
+import itertools
+from . import radl
+from .radl import Feature, RADL, configure, contextualize, contextualize_item, \
+                  deploy, SoftFeatures, Features, RADLParseException
+from .radl_parse import RADLParser
+try:
+	unicode("hola")
+except NameError:
+	class unicode: pass
+
+def _state_re(rules):
+	return re.compile("[ \t]*(?:%s)" % "|".join([ "(?P<%s>%s)" % r for r in rules ]))
+
+# Same rules and order as the ``t_*`` functions in RADLParser
+_INITIAL_RULES = (
+	("comment", r"\#.*"),
+	("LPAREN", r"\("),
+	("RPAREN", r"\)"),
+	("newline", r"\n"),
+	("NUMBER", r"\d+\.?\d*"),
+	# Same language as t_STRING, but unrolled so that long strings match fast
+	("STRING", r"'[^\\']*(?:\\.[^\\']*)*'"),
+	("VAR", r"[a-zA-Z_.][\w\d_.-]*"),
+	("RECIPE_BEGIN", r"@begin")
+)
+_BODY_RULES = (
+	("LE", r"<="),
+	("GE", r">="),
+	("EQ", r"="),
+	("GT", r">"),
+	("LT", r"<"),
+	("body_newline", r"\n")
+) + _INITIAL_RULES
+_INITIAL = _state_re(_INITIAL_RULES)
+_BODY = _state_re(_BODY_RULES)
+# A string without its closing quote; it never fails, unlike STRING
+_OPEN_STRING = re.compile(r"[ \t]*'[^\\']*(?:\\.[^\\']*)*")
+
+COMPARATORS = ("EQ", "LT", "GT", "GE", "LE", "CONTAINS")
+
+CHUNK_SIZE = 64 * 1024
+"""Size of the pieces read from files and HTTP responses."""
+
+def read_chunks(source, size=CHUNK_SIZE):
+	"""
+	Yield the text in ``source`` by pieces.
+
+	Args:
+	- source: a string, a file object, a ``requests`` response or an iterable
+	  of strings. Bytes are decoded with the ``encoding`` of the source or UTF-8.
+	- size(int): size of the pieces read from files and responses.
+	"""
+
+	if isinstance(source, (str, unicode)):
+		yield source
+		return
+	if hasattr(source, "iter_content"):
+		chunks = source.iter_content(size)
+	elif hasattr(source, "read"):
+		chunks = _read(source, size)
+	else:
+		chunks = source
+	decoder = None
+	for chunk in chunks:
+		if isinstance(chunk, bytes) and not isinstance(chunk, str):
+			if decoder is None:
+				encoding = getattr(source, "encoding", None) or "utf-8"
+				decoder = codecs.getincrementaldecoder(encoding)()
+			chunk = decoder.decode(chunk)
+		if chunk: yield chunk
+	if decoder is not None:
+		chunk = decoder.decode(b"", True)
+		if chunk: yield chunk
+
+def _read(f, size):
+	while True:
+		chunk = f.read(size)
+		if not chunk: return
+		yield chunk
+
+class _Buffer(object):
+	"""Text pending to be tokenized."""
+
+	def __init__(self, chunks):
+		self.chunks = iter(chunks)
+		self.text = ""
+		self.offset = 0
+		"""Position of ``text`` in the document."""
+		self.eof = False
+
+	def fill(self, pos):
+		"""
+		Drop the text before ``pos`` and read at least as much text as is left.
+
+		Return(int): the new position of ``pos``.
+		"""
+
+		text = [ self.text[pos:] ]
+		need, n = max(len(text[0]), 1), 0
+		while n < need:
+			chunk = next(self.chunks, None)
+			if chunk is None:
+				self.eof = True
+				break
+			text.append(chunk)
+			n += len(chunk)
+		self.text = "".join(text)
+		self.offset += pos
+		return 0
+
+def _partial(text, pos):
+	"""Return whether the text from ``pos`` may be the beginning of a token."""
+
+	c = text[pos:pos+1]
+	return not c or c in " \t'@"
+
+def tokenize(data):
+	"""
+	Yield the tokens in a RADL document.
+
+	Args:
+	- data(str or iterable of str): RADL content, maybe split in pieces.
+
+	Return(iterable of tuple): ``(type, value, lineno, lexpos)`` for every token.
+	"""
+
+	reserved = RADLParser.reserved
+	buf = _Buffer((data,) if isinstance(data, (str, unicode)) else data)
+	text, pos, lineno = "", 0, 1
+	state, stack = _INITIAL, []
+	while True:
+		if not buf.eof:
+			m = _OPEN_STRING.match(text, pos)
+			if m and not text.startswith("'", m.end()):
+				# The string ends in the next piece
+				pos = buf.fill(pos)
+				text = buf.text
+				continue
+		m = state.match(text, pos)
+		if not buf.eof and (m.end() == len(text) if m else _partial(text, pos)):
+			# The token may continue in the next piece
+			pos = buf.fill(pos)
+			text = buf.text
+			continue
+		if m is None:
+			if pos >= len(text):
+				return
+			# Like t_ANY_error, skip the character
+			pos += 1
+			continue
+		kind = m.lastgroup
+		start, pos = m.start(kind), m.end()
+		if kind == "comment":
+			continue
+		elif kind == "body_newline":
+			lineno += 1
+			continue
+		elif kind == "newline":
+			yield (kind, "\n", lineno, buf.offset + start)
+			lineno += 1
+			continue
+		value = m.group(kind)
+		if kind == "VAR":
+			kind = reserved.get(value, "VAR")
+		elif kind == "NUMBER":
+			value = float(value) if "." in value else int(value)
+		elif kind == "STRING":
+			value = value[1:-1].replace("\\'", "'")
+		elif kind == "LPAREN":
+			stack.append(state)
+			state = _BODY
+		elif kind == "RPAREN":
+			if not stack:
+				raise RADLParseException("Parse error in: unbalanced ')'", line=lineno)
+			state = stack.pop()
+		elif kind == "RECIPE_BEGIN":
+			yield (kind, value, lineno, buf.offset + start)
+			while len(text) - pos < 4 and not buf.eof:
+				pos = buf.fill(pos)
+				text = buf.text
+			if not text.startswith("@end", pos):
+				# The recipe runs until a line starting with '@end'
+				i = text.find("\n@end", pos)
+				while i < 0 and not buf.eof:
+					searched = len(text) - pos
+					pos = buf.fill(pos)
+					text = buf.text
+					i = text.find("\n@end", max(pos, searched - 4))
+				recipe = text[pos:i+1] if i >= 0 else text[pos:]
+				yield ("RECIPE", recipe, lineno, buf.offset + pos)
+				lineno += recipe.count("\n")
+				if i < 0:
+					return
+				pos = i + 1
+			yield ("RECIPE_END", "@end", lineno, buf.offset + pos)
+			pos += 4
+			continue
+		yield (kind, value, lineno, buf.offset + start)
+
+class TokenStream(object):
+	"""Tokens of a RADL document with one token of lookahead."""
+
+	def __init__(self, data):
+		self._tokens = tokenize(data)
+		self.tok = next(self._tokens, None)
+
+	def type(self):
+		"""Return the type of the next token or None at the end."""
+
+		return self.tok[0] if self.tok is not None else None
+
+	def expect(self, *types):
+		"""Consume and return the next token if it has one of the types."""
+
+		tok = self.tok
+		if tok is None or tok[0] not in types:
+			p_error(tok)
+		self.tok = next(self._tokens, None)
+		return tok
+
+	def unget(self, tok):
+		"""Return a consumed token to the stream."""
+
+		self._tokens = itertools.chain((self.tok,), self._tokens)
+		self.tok = tok
+
+def p_error(tok):
+	if tok is None:
+		raise RADLParseException("Parse error in: None")
+	if tok[0] == "RECIPE":
+		tok = ("RECIPE_LINE",) + tok[1:]
+	raise RADLParseException("Parse error in: LexToken(%s,%r,%d,%d)" % tok, line=tok[2])
+
+def parse_radl(data, aspects=None, features=None):
+	"""
+	Parse a RADL document.
+
+	Args:
+	- data(str): string with RADL content.
+	- aspects(list of str): if given, parse only the sentences whose aspect class
+	  (e.g. ``network``) or class and id (e.g. ``system front``) are in the list.
+	- features(list of str): if given, keep only the features whose name or a
+	  dotted prefix of it (e.g. ``disk.0.os.credentials``) is in the list.
+
+	Return: RADL object.
+	"""
+
+	r = RADL()
+	for a in p_radl(TokenStream(data + "\n"), aspects, features):
+		if a: r.add(a)
+	return r
+
+def parse_radl_iter(source, aspects=None, features=None):
+	"""
+	Parse a RADL document yielding every aspect as soon as its sentence ends.
+
+	The document is read by pieces, so the memory used is bounded by the largest
+	sentence and not by the whole document. The aspects are not added to a RADL,
+	so references and repeated ids are not merged and nothing is checked.
+
+	Args:
+	- source: a string, a file object, a ``requests`` response (better requested
+	  with ``stream=True``) or an iterable of strings.
+	- aspects(list of str) and features(list of str): as in ``parse_radl``.
+
+	Return(iterable of Aspect): the aspects in the document.
+	"""
+
+	for a in p_radl(TokenStream(itertools.chain(read_chunks(source), ("\n",))), aspects, features):
+		if a: yield a
+
+def p_radl(ts, aspects=None, features=None):
+	"""Yield the aspects of the selected sentences in the stream."""
+
+	aspects = None if aspects is None else frozenset(aspects)
+	features = None if features is None else frozenset(features)
+	while ts.tok is not None:
+		if ts.tok[0] == "newline":
+			ts.expect("newline")
+			continue
+		if aspects is None or p_selected(ts, aspects):
+			aspect = p_radl_sentence(ts, features)
+		else:
+			aspect = p_skip_sentence(ts)
+		ts.expect("newline")
+		yield aspect
+
+def p_selected(ts, aspects):
+	"""Return whether the class, or the class and id, of the next sentence is in ``aspects``."""
+
+	tok = ts.expect(ts.type())
+	selected = tok[1] in aspects or (ts.type() == "VAR" and "%s %s" % (tok[1], ts.tok[1]) in aspects)
+	ts.unget(tok)
+	return selected
+
+def p_skip_sentence(ts):
+	"""
+	Consume the tokens of the next sentence without building anything.
+
+	The recipes are not decoded and the syntax of the sentence is not checked.
+	"""
+
+	while ts.type() not in ("newline", None):
+		ts.expect(ts.type())
+	return None
+
+def p_feature_selected(f, features):
+	"""Return whether the name of a feature or a dotted prefix of it is in ``features``."""
+
+	prop = getattr(f, "prop", None)
+	while prop:
+		if prop in features: return True
+		prop = prop.rpartition(".")[0]
+	return False
+
+def p_radl_sentence(ts, features=None):
+	t = ts.type()
+	if t == "CONFIGURE":
+		return p_configure_sentence(ts)
+	elif t == "CONTEXTUALIZE":
+		return p_contextualize_sentence(ts)
+	elif t == "DEPLOY":
+		return p_deploy_sentence(ts)
+	return p_cfeatures_sentence(ts, features)
+
+def p_configure_sentence(ts):
+	line = ts.expect("CONFIGURE")[2]
+	name = ts.expect("VAR")[1]
+	if ts.type() != "LPAREN":
+		return configure(name, reference=True, line=line)
+	ts.expect("LPAREN")
+	ts.expect("RECIPE_BEGIN")
+	_, recipe, recipe_line, _ = ts.expect("RECIPE")
+	ts.expect("RECIPE_END")
+	ts.expect("RPAREN")
+	return configure(name, line=line, recipe_text=recipe, recipe_line=recipe_line)
+
+def p_deploy_sentence(ts):
+	line = ts.expect("DEPLOY")[2]
+	name = ts.expect("VAR")[1]
+	vm_number = ts.expect("NUMBER")[1]
+	if ts.type() == "VAR":
+		return deploy(name, vm_number, ts.expect("VAR")[1], line=line)
+	return deploy(name, vm_number, line=line)
+
+def p_contextualize_sentence(ts):
+	line = ts.expect("CONTEXTUALIZE")[2]
+	max_time = ts.expect("NUMBER")[1] if ts.type() == "NUMBER" else None
+	ts.expect("LPAREN")
+	options = []
+	while ts.type() == "OPTION":
+		options.append(p_contextualize_option(ts))
+	items = []
+	while ts.type() == "SYSTEM":
+		items.append(p_contextualize_item(ts))
+	ts.expect("RPAREN")
+	if max_time is None:
+		return contextualize(items, options=options, line=line)
+	return contextualize(items, max_time, options=options, line=line)
+
+def p_contextualize_option(ts):
+	line = ts.expect("OPTION")[2]
+	prop = ts.expect("VAR")[1]
+	operator = p_comparator(ts)
+	return Feature(prop, operator, ts.expect("STRING", "NUMBER")[1], line=line)
+
+def p_contextualize_item(ts):
+	line = ts.expect("SYSTEM")[2]
+	system_id = ts.expect("VAR")[1]
+	ts.expect("CONFIGURE")
+	configure_id = ts.expect("VAR")[1]
+	if ts.type() == "STEP":
+		ts.expect("STEP")
+		return contextualize_item(system_id, configure_id, ts.expect("NUMBER")[1], line=line)
+	return contextualize_item(system_id, configure_id, line=line)
+
+def p_aspect_class(name, line):
+	try:
+		return getattr(radl, name)
+	except:
+		raise RADLParseException("'%s' is not an aspect." % name, line=line)
+
+def p_cfeatures_sentence(ts, selected=None):
+	_, cls, line, _ = ts.expect("SYSTEM", "VAR")
+	name = ts.expect("VAR")[1]
+	if ts.type() != "LPAREN":
+		return p_aspect_class(cls, line)(name, reference=True, line=line)
+	ts.expect("LPAREN")
+	features = p_features(ts)
+	ts.expect("RPAREN")
+	if selected is not None:
+		features = [ f for f in features if p_feature_selected(f, selected) ]
+	return p_aspect_class(cls, line)(name, features, line=line)
+
+def p_features(ts):
+	features = []
+	if ts.type() not in ("AND", "RPAREN"):
+		features.append(p_feature(ts))
+	while ts.type() == "AND":
+		ts.expect("AND")
+		features.append(p_feature(ts))
+	return features
+
+def p_feature(ts):
+	if ts.type() == "SOFT":
+		line = ts.expect("SOFT")[2]
+		soft = ts.expect("NUMBER")[1]
+		ts.expect("LPAREN")
+		features = p_features(ts)
+		ts.expect("RPAREN")
+		return SoftFeatures(soft, features, line=line)
+	_, prop, line, _ = ts.expect("VAR")
+	operator = p_comparator(ts)
+	t = ts.type()
+	if operator == "contains" and t == "LPAREN":
+		ts.expect("LPAREN")
+		features = p_features(ts)
+		ts.expect("RPAREN")
+		return Feature(prop, operator, Features(features), line=line)
+	elif t == "NUMBER":
+		value = ts.expect("NUMBER")[1]
+		unit = ts.expect("VAR")[1] if ts.type() == "VAR" else None
+		return Feature(prop, operator, value, unit=unit, line=line)
+	elif t == "STRING":
+		return Feature(prop, operator, ts.expect("STRING")[1], unit=None, line=line)
+	_, cls, ref_line, _ = ts.expect("SYSTEM", "VAR")
+	name = ts.expect("VAR")[1]
+	value = p_aspect_class(cls, ref_line)(name, reference=True, line=ref_line)
+	return Feature(prop, operator, value, unit=None, line=line)
+
+def p_comparator(ts):
+	return ts.expect(*COMPARATORS)[1]
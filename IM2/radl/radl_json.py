@@ -19,31 +19,154 @@ try:
 except ImportError:
 	import simplejson as json
 try:
-	from jsonschema import validate
+	from jsonschema import Draft4Validator
 except ImportError:
-	validate = None
-try:
-	import yaml
-except ImportError:
-	yaml = None
+	Draft4Validator = None
 try:
 	unicode("hola")
 except NameError:
 	class unicode: pass
 
-from .radl import Feature, Features, Aspect, RADL, configure, contextualize, contextualize_item, deploy, SoftFeatures, UnitToValue
+from .radl import Feature, Features, Aspect, RADL, configure, contextualize, contextualize_item, deploy, SoftFeatures, UnitToValue, \
+                  sorted_features
 from . import radl
+from .radl_parse import CHUNK_SIZE
 import os.path
+import re
 schema_path = os.path.join(os.path.dirname(os.path.abspath(radl.__file__ )), "radl_schema.json")
 radl_schema = json.load(open(schema_path, 'r'))
 
+_validator = None
+
+def get_validator():
+	"""Return the process-wide validator of ``radl_schema``, building it the first time."""
+
+	global _validator
+	if _validator is None:
+		Draft4Validator.check_schema(radl_schema)
+		_validator = Draft4Validator(radl_schema)
+	return _validator
+
 def encode_simple(d):
 	"""Encode strings in basic python objects."""
 	if isinstance(d, unicode): return d.encode()
 	if isinstance(d, list): return list(map(encode_simple, d))
 	if isinstance(d, dict): return dict([ (encode_simple(k), encode_simple(v)) for k,v in d.items() ])
 	return d
-	
+
+class _NotSimple(Exception):
+	"""Raised by the simple validators on what they do not check."""
+
+# Like ``idString`` in the schema, but without the newline that "$" takes at the end
+_ID_STRING = re.compile(r"[a-zA-Z._\-][a-zA-Z0-9._\-]*\Z")
+
+def _s_string(v):
+	if isinstance(v, unicode): return v.encode()
+	if isinstance(v, str): return v
+	raise _NotSimple()
+
+def _s_id(v):
+	v = _s_string(v)
+	if not _ID_STRING.match(v): raise _NotSimple()
+	return v
+
+def _s_number(v):
+	if isinstance(v, bool) or not isinstance(v, (int, float)): raise _NotSimple()
+	return v
+
+def _s_integer(v, minimum):
+	if isinstance(v, bool) or not isinstance(v, int) or v < minimum: raise _NotSimple()
+	return v
+
+def _s_keys(a, allowed, required=()):
+	if not isinstance(a, dict) or any(k not in allowed for k in a) or any(k not in a for k in required):
+		raise _NotSimple()
+
+def _s_reference(a):
+	_s_keys(a, ("class", "id", "reference"), ("class", "id", "reference"))
+	if a["reference"] is not True: raise _NotSimple()
+	return { "class": _s_id(a["class"]), "id": _s_id(a["id"]), "reference": True }
+
+def _s_features(a):
+	if not isinstance(a, dict): raise _NotSimple()
+	return dict((_s_id(k), _s_value(v)) for k, v in a.items())
+
+def _s_value(v, array=True):
+	if isinstance(v, dict):
+		return _s_reference(v) if v.get("reference") is True else _s_features(v)
+	if isinstance(v, list) and array:
+		return [ _s_value(i, False) for i in v ]
+	if isinstance(v, (int, float)) and not isinstance(v, bool):
+		return v
+	return _s_string(v)
+
+def _s_cfeatures(a):
+	if "reference" in a:
+		return _s_reference(a)
+	r = _s_features(a)
+	_s_id(r.get("class"))
+	_s_id(r.get("id"))
+	if not isinstance(r.get("softs", []), list): raise _NotSimple()
+	for s in r.get("softs", []):
+		_s_keys(s, ("weight", "items"))
+		if "weight" in s: _s_number(s["weight"])
+		if not isinstance(s.get("items", {}), dict): raise _NotSimple()
+	return r
+
+def _s_configure(a):
+	if "reference" in a:
+		return _s_reference(a)
+	_s_keys(a, ("class", "id", "recipe"), ("class", "id", "recipe"))
+	if not isinstance(a["recipe"], (str, unicode, dict, list)): raise _NotSimple()
+	return { "class": "configure", "id": _s_id(a["id"]), "recipe": encode_simple(a["recipe"]) }
+
+def _s_contextualize(a):
+	_s_keys(a, ("class", "items", "options"))
+	r = { "class": "contextualize" }
+	if "items" in a:
+		if not isinstance(a["items"], list): raise _NotSimple()
+		r["items"] = []
+		for i in a["items"]:
+			_s_keys(i, ("system", "configure", "step"), ("system", "configure"))
+			i0 = { "system": _s_id(i["system"]), "configure": _s_id(i["configure"]) }
+			if "step" in i: i0["step"] = _s_integer(i["step"], 0)
+			r["items"].append(i0)
+	if "options" in a:
+		if not isinstance(a["options"], dict): raise _NotSimple()
+		r["options"] = encode_simple(a["options"])
+	return r
+
+def _s_deploy(a):
+	_s_keys(a, ("class", "system", "vm_number", "cloud_id"), ("system", "vm_number"))
+	r = { "class": "deploy", "system": _s_id(a["system"]), "vm_number": _s_integer(a["vm_number"], 1) }
+	if "cloud_id" in a: r["cloud_id"] = _s_id(a["cloud_id"])
+	return r
+
+_SIMPLE_ASPECTS = { "configure": _s_configure, "contextualize": _s_contextualize, "deploy": _s_deploy }
+"""Simple validators by class; other classes are validated as ``cfeatures``."""
+
+def _s_aspect(a):
+	if not isinstance(a, dict): raise _NotSimple()
+	return _SIMPLE_ASPECTS.get(_s_string(a.get("class")), _s_cfeatures)(a)
+
+def validate_simple(data):
+	"""
+	Validate a decoded RADL JSON document with ``radl_schema`` and return it encoded.
+
+	The common aspects are validated and encoded by hand in a single pass, and
+	the schema validator is used only if any of them is not; so the validation
+	errors are the ones of ``jsonschema``.
+	"""
+
+	if isinstance(data, list) and data:
+		try:
+			return [ _s_aspect(a) for a in data ]
+		except _NotSimple:
+			pass
+	if Draft4Validator:
+		get_validator().validate(data)
+	return encode_simple(data)
+
 def parse_radl(data):
 	"""
 	Parse a RADL document in JSON.
@@ -56,9 +179,7 @@ def parse_radl(data):
 
 	if not isinstance(data, list):
 		data = json.loads(data)
-	if validate:
-		validate(data, radl_schema)
-	data = encode_simple(data)
+	data = validate_simple(data)
 	return RADL([ p_aspect(a) for a in data ])
 
 def p_aspect(a):
@@ -77,11 +198,8 @@ def p_configure(a):
 	if a.get("reference", False):
 		return configure(a["id"], reference=True)
 	recipe = a["recipe"]
-	if isinstance(recipe, str) and yaml:
-		try:
-			recipe = yaml.safe_load(recipe)
-		except Exception as e:
-			raise RADLParseException("Error parsing YAML: %s" % str(e))
+	if isinstance(recipe, str):
+		return configure(a["id"], recipe_text=recipe)
 	return configure(a["id"], recipe)
 
 def p_contextualize(a):
@@ -138,6 +256,67 @@ def dump_radl(radl, enter="\n", indent="  "):
 	separators = (",", ":" if indent is None else ": ")
 	return json.dumps(radlToSimple(radl), indent=indent, sort_keys=sort_keys, separators=separators)
 
+def dump_radl_to(stream, radl, enter="\n", indent="  "):
+	"""
+	Write a RADL document in JSON to a file object aspect by aspect.
+
+	The text written is the same as the one returned by ``dump_radl``, but the
+	whole document is never held in memory, and long strings, like the
+	contextualization logs, are written in slices.
+
+	Args.:
+	- stream: object with a ``write`` method, like a file or ``sys.stdout``.
+	- radl(RADL), enter(str) and indent(str): as in ``dump_radl``; without
+	  ``enter`` the output is compact, without indentation nor sorted keys.
+	"""
+
+	indent = len(indent) if enter else None
+	sort_keys = indent is not None
+	separators = (",", ":" if indent is None else ": ")
+	write = stream.write
+	for piece in j_radl(radl, indent, sort_keys, separators):
+		write(piece)
+
+# The ``j_*`` functions yield the pieces of the JSON text of every element.
+
+def j_radl(radl, indent, sort_keys, separators):
+	assert isinstance(radl, RADL)
+	encoder = json.JSONEncoder(indent=indent, sort_keys=sort_keys, separators=separators)
+	first = True
+	yield "["
+	for a in radl.aspects:
+		yield ("" if first else separators[0]) + j_newline(indent, 1)
+		first = False
+		for i in j_object(aspectToSimple(a), 1, encoder, sort_keys, separators): yield i
+	yield "]" if first else j_newline(indent, 0) + "]"
+
+def j_newline(indent, level):
+	return "" if indent is None else "\n" + " " * (indent * level)
+
+def j_object(d, level, encoder, sort_keys, separators):
+	if not d:
+		yield "{}"
+		return
+	first = True
+	yield "{"
+	for k in (sorted(d) if sort_keys else d):
+		yield ("" if first else separators[0]) + j_newline(encoder.indent, level + 1) + encoder.encode(k) + separators[1]
+		first = False
+		for i in j_value(d[k], level + 1, encoder): yield i
+	yield j_newline(encoder.indent, level) + "}"
+
+def j_value(v, level, encoder):
+	if isinstance(v, (str, unicode)) and len(v) > CHUNK_SIZE:
+		yield '"'
+		for i in range(0, len(v), CHUNK_SIZE):
+			yield encoder.encode(v[i:i + CHUNK_SIZE])[1:-1]
+		yield '"'
+		return
+	# Strings are encoded without line breaks, so the ones in the text are indentation
+	newline = j_newline(encoder.indent, level)
+	for i in encoder.iterencode(v):
+		yield i.replace("\n", newline) if newline else i
+
 def radlToSimple(radl):
 	"""
 	Return a list of maps whose values are only other maps or lists.
@@ -158,10 +337,11 @@ def aspectToSimple(a):
 
 def configureToSimple(a):
 	assert isinstance(a, configure)
-	if a.reference or not a.recipe:
+	recipe = a.getRecipe()
+	if a.reference or not recipe:
 		return { "class": "configure", "id": a.name, "reference": True }
 	else:
-		return { "class": "configure", "id": a.name, "recipe": a.recipe }
+		return { "class": "configure", "id": a.name, "recipe": recipe }
 
 def contextualizeToSimple(a):
 	assert isinstance(a, contextualize)
@@ -199,11 +379,13 @@ def featuresToSimple(a):
 	for k, v in a.props.items():
 		if k == SoftFeatures.SOFT:
 			r["softs"] = [ {"weight": i.soft, "items": featuresToSimple(i)}
-			               for i in a.props[SoftFeatures.SOFT] ]
+			               for i in sorted_features(a.props[SoftFeatures.SOFT]) ]
 		elif isinstance(v, tuple):
 			r[k+"_min"] = "-inf" if v[0] is None else featureToSimple(v[0].value, v[0].unit)
 			r[k+"_max"] = "inf" if v[1] is None else featureToSimple(v[1].value, v[1].unit)
-		elif isinstance(v, (set, list)):
+		elif isinstance(v, set):
+			r[k] = [ featureToSimple(i.value, i.unit) for i in sorted_features(v) ]
+		elif isinstance(v, list):
 			r[k] = [ featureToSimple(i.value, i.unit) for i in v ]
 		elif isinstance(v, dict):
 			r[k] = [ featureToSimple(i.value, i.unit) for i in v.values() ]
@@ -0,0 +1,10 @@
+# radl_lextab.py. This file automatically created by PLY (version 3.11). Don't edit!
+_tabversion   = '3.10'
+_lextokens    = set(('AND', 'CONFIGURE', 'CONTAINS', 'CONTEXTUALIZE', 'DEPLOY', 'EQ', 'GE', 'GT', 'LE', 'LPAREN', 'LT', 'NUMBER', 'OPTION', 'RECIPE_BEGIN', 'RECIPE_END', 'RECIPE_LINE', 'RPAREN', 'SOFT', 'STEP', 'STRING', 'SYSTEM', 'VAR', 'newline'))
+_lexreflags   = 64
+_lexliterals  = ''
+_lexstateinfo = {'INITIAL': 'inclusive', 'recipe': 'exclusive', 'body': 'inclusive'}
+_lexstatere   = {'INITIAL': [("(?P<t_comment>\\#.*)|(?P<t_LPAREN>\\()|(?P<t_RPAREN>\\))|(?P<t_newline>\\n)|(?P<t_NUMBER>\\d+\\.?\\d*)|(?P<t_STRING>'([^\\\\']|\\\\.)*')|(?P<t_VAR>[a-zA-Z_.][\\w\\d_.-]*)|(?P<t_RECIPE_BEGIN>@begin)", [None, ('t_comment', 'comment'), ('t_LPAREN', 'LPAREN'), ('t_RPAREN', 'RPAREN'), ('t_newline', 'newline'), ('t_NUMBER', 'NUMBER'), ('t_STRING', 'STRING'), None, ('t_VAR', 'VAR'), ('t_RECIPE_BEGIN', 'RECIPE_BEGIN')])], 'recipe': [('(?P<t_recipe_RECIPE_END>@end)|(?P<t_recipe_RECIPE_LINE>.*\\n)', [None, ('t_recipe_RECIPE_END', 'RECIPE_END'), ('t_recipe_RECIPE_LINE', 'RECIPE_LINE')])], 'body': [('(?P<t_body_LE><=)|(?P<t_body_GE>>=)|(?P<t_body_EQ>=)|(?P<t_body_GT>>)|(?P<t_body_LT><)|(?P<t_body_newline>\\n)', [None, ('t_body_LE', 'LE'), ('t_body_GE', 'GE'), ('t_body_EQ', 'EQ'), ('t_body_GT', 'GT'), ('t_body_LT', 'LT'), ('t_body_newline', 'newline')]), ("(?P<t_comment>\\#.*)|(?P<t_LPAREN>\\()|(?P<t_RPAREN>\\))|(?P<t_newline>\\n)|(?P<t_NUMBER>\\d+\\.?\\d*)|(?P<t_STRING>'([^\\\\']|\\\\.)*')|(?P<t_VAR>[a-zA-Z_.][\\w\\d_.-]*)|(?P<t_RECIPE_BEGIN>@begin)", [None, ('t_comment', 'comment'), ('t_LPAREN', 'LPAREN'), ('t_RPAREN', 'RPAREN'), ('t_newline', 'newline'), ('t_NUMBER', 'NUMBER'), ('t_STRING', 'STRING'), None, ('t_VAR', 'VAR'), ('t_RECIPE_BEGIN', 'RECIPE_BEGIN')])]}
+_lexstateignore = {'body': ' \t', 'INITIAL': ' \t', 'recipe': ''}
+_lexstateerrorf = {'INITIAL': 't_ANY_error', 'recipe': 't_ANY_error', 'body': 't_ANY_error'}
+_lexstateeoff = {}
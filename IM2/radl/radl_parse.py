@@ -15,6 +15,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import re
+import sys
+import threading
 from ply import lex
 from ply import yacc
 from . import radl
@@ -29,12 +32,17 @@ try:
 except NameError:
 	class unicode: pass
 
+# PLY tables shipped with the package; regenerate them with ``write_tables``
+# after changing the grammar.
+LEXTAB = "IM2.radl.radl_lextab"
+PARSETAB = "IM2.radl.radl_parsetab"
+
 class RADLParser:
 
-	def __init__(self, autodefinevars = True, **kwargs):
-		outputdir = os.path.expanduser('~/.ec3/')
-		self.lexer = lex.lex(module=self, debug=0, optimize=1, outputdir=outputdir, **kwargs)
-		self.yacc = yacc.yacc(module=self, debug=0, optimize=1, outputdir=outputdir)
+	def __init__(self, autodefinevars = True, outputdir = None, write_tables = False, **kwargs):
+		self.lexer = lex.lex(module=self, debug=0, optimize=1, lextab=LEXTAB, outputdir=outputdir, **kwargs)
+		self.yacc = yacc.yacc(module=self, debug=0, optimize=1, tabmodule=PARSETAB,
+		                      outputdir=outputdir, write_tables=write_tables)
 
 	# LEXER ITEMS
 	# Ponemos los estados para gestionan el tema de las recetas
@@ -203,13 +211,7 @@ class RADLParser:
 		if len(t) == 3:
 			t[0] = configure(t[2], reference=True, line=t.lineno(1))
 		else:
-			recipe = "".join(t[5])
-			if yaml:
-				try:
-					recipe = yaml.safe_load(recipe)
-				except Exception as e:
-					raise RADLParseException("Error parsing YAML: %s" % str(e), line=t.lineno(5))
-			t[0] = configure(t[2], recipe, line=t.lineno(1))
+			t[0] = configure(t[2], line=t.lineno(1), recipe_text="".join(t[5]), recipe_line=t.lineno(5))
 	
 	def p_recipe(self, t):
 		"""recipe : recipe RECIPE_LINE
@@ -372,22 +374,73 @@ class RADLParser:
 	def parse(self, data):
 		data = data + "\n"
 		self.lexer.lineno = 1
+		self.lexer.lexstatestack = []
 		self.lexer.begin('INITIAL')
 		return self.yacc.parse(data, tracking=True, debug=0, lexer=self.lexer)
 	
-def parse_radl(data):
+_parser = None
+_parser_lock = threading.Lock()
+
+def get_parser():
+	"""
+	Return the process-wide parser, building it the first time.
+
+	The lexer and the parser keep state while parsing, so use it under
+	``_parser_lock``, as ``parse_radl`` does.
+	"""
+
+	global _parser
+	if _parser is None:
+		_parser = RADLParser()
+	return _parser
+
+def write_tables(outputdir=None):
+	"""
+	Regenerate the PLY tables.
+
+	Args:
+	- outputdir(str, optional): where to write them; by default, next to this module.
+	"""
+
+	if outputdir is None:
+		outputdir = os.path.dirname(os.path.abspath(__file__))
+	for tab in (LEXTAB, PARSETAB):
+		sys.modules.pop(tab, None)
+		path = os.path.join(outputdir, tab.rsplit(".", 1)[1] + ".py")
+		if os.path.exists(path): os.unlink(path)
+	RADLParser(outputdir=outputdir, write_tables=True)
+
+def parse_radl(data, engine="ply", aspects=None, features=None):
 	"""
 	Parse a RADL document.
 
 	Args:
 	- data(str): string with RADL content.
+	- engine(str): ``"ply"`` to use ``RADLParser`` or ``"fast"`` to use the
+	  hand-written parser in ``radl_fastparse``, which is faster on documents
+	  with large recipes.
+	- aspects(list of str): if given, parse only the sentences whose aspect class
+	  (e.g. ``network``) or class and id (e.g. ``system front``) are in the list;
+	  the other sentences are skipped without decoding their recipes.
+	- features(list of str): if given, keep only the features whose name or a
+	  dotted prefix of it is in the list.
+
+	Selecting aspects or features implies ``engine="fast"``.
 
 	Return: RADL object.
 	"""
-	parser = RADLParser()
-	return parser.parse(data)
+
+	assert engine in ("ply", "fast"), "Invalid value in `engine`."
+	if engine == "fast" or aspects is not None or features is not None:
+		from .radl_fastparse import parse_radl as parse_radl_fast
+		return parse_radl_fast(data, aspects, features)
+	with _parser_lock:
+		return get_parser().parse(data)
 
 
+CHUNK_SIZE = 64 * 1024
+"""Largest piece of a string value or a recipe emitted at once when dumping."""
+
 def dump_radl(radl, enter="\n", margin="", indent="  "):
 	"""
 	Dump a RADL document.
@@ -401,11 +454,45 @@ def dump_radl(radl, enter="\n", margin="", indent="  "):
 	Return(str): a text representing the RADL.
 	"""
 
-	return d_radl(radl, enter, margin, indent)
+	return "".join(d_radl(radl, enter, margin, indent))
+
+def dump_radl_to(stream, radl, enter="\n", margin="", indent="  "):
+	"""
+	Write a RADL document to a file object sentence by sentence.
+
+	The text written is the same as the one returned by ``dump_radl``, but the
+	whole document is never held in memory.
+
+	Args.:
+	- stream: object with a ``write`` method, like a file or ``sys.stdout``.
+	- radl(RADL), enter(str), margin(str) and indent(str): as in ``dump_radl``.
+	"""
+
+	write = stream.write
+	for piece in d_radl(radl, enter, margin, indent):
+		write(piece)
+
+# The ``d_*`` functions yield the pieces of the text of every element.
+
+def d_join(sep, pieces):
+	"""Yield the pieces of every generator in ``pieces`` with ``sep`` between them."""
+
+	first = True
+	for p in pieces:
+		if not first: yield sep
+		first = False
+		for i in p: yield i
+
+def d_slices(text, start, end, escape=False):
+	"""Yield ``text[start:end]`` in slices, escaping quotes if ``escape``."""
+
+	for i in range(start, end, CHUNK_SIZE):
+		piece = text[i:min(i + CHUNK_SIZE, end)]
+		yield piece.replace("'", "\\'") if escape else piece
 
 def d_radl(radl, enter, margin, indent):
 	assert isinstance(radl, RADL)
-	return (enter*2).join([ d_radl_sentence(a, enter, margin, indent) for a in radl.aspects ])
+	return d_join(enter*2, [ d_radl_sentence(a, enter, margin, indent) for a in radl.aspects ])
 
 def d_radl_sentence(aspect, *args):
 	assert isinstance(aspect, Aspect)
@@ -418,50 +505,68 @@ def d_radl_sentence(aspect, *args):
 	else:
 		return d_cfeatures_sentence(aspect, *args)
 
+_BLANK = re.compile(r"\s*\Z")
+
 def d_configure_sentence(a, enter, margin, indent):
 	assert isinstance(a, configure)
-	if a.reference or not a.recipe:
-		return "%sconfigure %s" % (margin, a.name)
-	def tostr(r):
-		return r if isinstance(r, (str, unicode)) else yaml.safe_dump(r, default_flow_style=False) if yaml else str(r)
-	return "{margin}configure {name} ({enter}@begin{enter}{recipe}{enter}@end{enter}{margin})".format(
-		name=a.name, recipe=tostr(a.recipe), enter=enter, margin=margin)
+	# Dump the text of recipes not decoded yet as it is, without the surrounding new lines
+	text = a.recipe_text
+	if text is not None:
+		start, end = 0, len(text)
+		while start < end and text[start] == "\n": start += 1
+		while end > start and text[end-1] == "\n": end -= 1
+	else:
+		recipe = a.getRecipe()
+	if a.reference or (not recipe if text is None else _BLANK.match(text, start, end)):
+		yield "%sconfigure %s" % (margin, a.name)
+		return
+	yield "{margin}configure {name} ({enter}@begin{enter}".format(name=a.name, enter=enter, margin=margin)
+	if text is not None:
+		for i in d_slices(text, start, end): yield i
+	elif isinstance(recipe, (str, unicode)):
+		yield recipe
+	else:
+		yield yaml.safe_dump(recipe, default_flow_style=False) if yaml else str(recipe)
+	yield "{enter}@end{enter}{margin})".format(enter=enter, margin=margin)
 
 def d_deploy_sentence(a, enter, margin, indent):
 	assert isinstance(a, deploy)
-	return "{margin}deploy {id} {number}{cloud}".format(
+	yield "{margin}deploy {id} {number}{cloud}".format(
 		margin=margin, id=a.id, number=a.vm_number,
 		cloud=" " + a.cloud_id if a.cloud_id else "")
 
 def d_contextualize_sentence(a, enter, margin, indent):
 	assert isinstance(a, contextualize)
-	return "{margin}contextualize {number}({enter}{options}{sep}{items}{enter}{margin})".format(
-		enter=enter, margin=margin, number="%d " % a.max_time if a.max_time else "", options=enter.join(
-			[ d_contextualize_option(i, enter, margin+indent, indent) for i in a.options.values() ]),
-		sep=enter if a.options else "",
-		items=enter.join(
-			[ d_contextualize_item(i, enter, margin+indent, indent) for i in a.items.values() ]))
+	yield "{margin}contextualize {number}({enter}".format(
+		enter=enter, margin=margin, number="%d " % a.max_time if a.max_time else "")
+	for i in d_join(enter, [ d_contextualize_option(i, enter, margin+indent, indent)
+	                          for i in a.options.values() ]): yield i
+	if a.options: yield enter
+	for i in d_join(enter, [ d_contextualize_item(i, enter, margin+indent, indent)
+	                          for i in a.items.values() ]): yield i
+	yield enter + margin + ")"
 
 def d_contextualize_option(a, enter, margin, indent):
 	assert isinstance(a, Feature)
-	return "{margin}option {option}".format(
-		margin=margin, option=d_feature(a, enter, margin, indent))
+	yield "%soption " % margin
+	for i in d_feature(a, enter, margin, indent): yield i
 
 def d_contextualize_item(a, enter, margin, indent):
 	assert isinstance(a, contextualize_item)
-	return "{margin}system {sys} configure {conf}{num}".format(
+	yield "{margin}system {sys} configure {conf}{num}".format(
 		margin=margin, sys=a.system, conf=a.configure, num=" step %d" % a.num if a.num else "")
 
 def d_cfeatures_sentence(a, enter, margin, indent):
 	assert isinstance(a, Features)
-	cls = a.__class__.__name__
-	return "{margin}{cls} {id}{rest}".format(margin=margin, cls=cls, id=a.getId(),
-		rest=" ({enter}{fs}{enter}{margin})".format(enter=enter, margin=margin,
-			fs=d_features(a, enter, margin+indent, indent)) if not a.reference else "")
+	yield "{margin}{cls} {id}".format(margin=margin, cls=a.__class__.__name__, id=a.getId())
+	if not a.reference:
+		yield " (" + enter
+		for i in d_features(a, enter, margin+indent, indent): yield i
+		yield enter + margin + ")"
 
 def d_features(a, enter, margin, indent):
 	assert isinstance(a, Features)
-	return (" and%s" % enter).join([ d_feature(i, enter, margin, indent) for i in a.features ])
+	return d_join(" and%s" % enter, [ d_feature(i, enter, margin, indent) for i in a.features ])
 
 def d_feature(a, *args):
 	assert isinstance(a, Feature)
@@ -476,25 +581,30 @@ def d_feature(a, *args):
 
 def d_feature_soft(a, enter, margin, indent):
 	assert isinstance(a, SoftFeatures)
-	return "{margin}soft {soft} ({enter}{fs}{enter}{margin})".format(
-		enter=enter, margin=margin, soft=a.soft,
-		fs=d_features(a, enter, margin+indent, indent))
+	yield "{margin}soft {soft} ({enter}".format(enter=enter, margin=margin, soft=a.soft)
+	for i in d_features(a, enter, margin+indent, indent): yield i
+	yield enter + margin + ")"
 
 def d_feature_number_string(a, enter, margin, indent):
 	assert isinstance(a, Feature) and isinstance(a.value, (int, float, str, unicode))
-	return "{margin}{prop} {op} {val}".format(
-		margin=margin, prop=a.prop, op=a.operator,
-		val="'%s'" % a.value.replace("'", "\\'") if isinstance(a.value, (str, unicode))
-	            else "%s%s" % (a.value, a.unit if a.unit else ""))
+	if not isinstance(a.value, (str, unicode)):
+		yield "{margin}{prop} {op} {val}".format(margin=margin, prop=a.prop, op=a.operator,
+			val="%s%s" % (a.value, a.unit if a.unit else ""))
+	elif len(a.value) <= CHUNK_SIZE:
+		yield "{margin}{prop} {op} '{val}'".format(margin=margin, prop=a.prop, op=a.operator,
+			val=a.value.replace("'", "\\'"))
+	else:
+		yield "{margin}{prop} {op} '".format(margin=margin, prop=a.prop, op=a.operator)
+		for i in d_slices(a.value, 0, len(a.value), escape=True): yield i
+		yield "'"
 
 def d_feature_reference(a, enter, margin, indent):
 	assert isinstance(a, Feature) and isinstance(a.value, Aspect)
-	return "{margin}{prop} {op} {cls} {id}".format(
+	yield "{margin}{prop} {op} {cls} {id}".format(
 		margin=margin, prop=a.prop, op=a.operator, cls=a.value.__class__.__name__, id=a.value.getId())
 
 def d_feature_features(a, enter, margin, indent):
 	assert isinstance(a, Feature) and isinstance(a.value, Features)
-	return "{margin}{prop} {op} ({enter}{fs}{enter}{margin})".format(
-		margin=margin, enter=enter, prop=a.prop, op=a.operator,
-		fs=d_features(a.value, enter, margin+indent, indent))
-
+	yield "{margin}{prop} {op} ({enter}".format(margin=margin, enter=enter, prop=a.prop, op=a.operator)
+	for i in d_features(a.value, enter, margin+indent, indent): yield i
+	yield enter + margin + ")"
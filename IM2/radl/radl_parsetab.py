@@ -0,0 +1,81 @@
+
+# radl_parsetab.py
+# This file is automatically generated. Do not edit.
+# pylint: disable=W,C,R
+_tabversion = '3.10'
+
+_lr_method = 'LALR'
+
+_lr_signature = 'AND CONFIGURE CONTAINS CONTEXTUALIZE DEPLOY EQ GE GT LE LPAREN LT NUMBER OPTION RECIPE_BEGIN RECIPE_END RECIPE_LINE RPAREN SOFT STEP STRING SYSTEM VAR newlineradl : radl radl_sentence_end\n\t\t        | radl_sentence_endradl_sentence_end : radl_sentence END\n\t\t                     | ENDradl_sentence : configure_sentence\n\t\t                 | contextualize_sentence\n\t\t                 | deploy_sentence\n\t\t                 | cfeatures_sentenceconfigure_sentence : CONFIGURE VAR\n\t\t                      | CONFIGURE VAR LPAREN RECIPE_BEGIN recipe RECIPE_END RPARENrecipe : recipe RECIPE_LINE\n\t\t          | RECIPE_LINEdeploy_sentence : DEPLOY VAR NUMBER\n\t\t                   | DEPLOY VAR NUMBER VARcontextualize_sentence : CONTEXTUALIZE LPAREN contextualize_options contextualize_items RPAREN\n\t\t                          | CONTEXTUALIZE NUMBER  LPAREN contextualize_options contextualize_items RPARENcontextualize_options : contextualize_options contextualize_option\n\t\t\t\t\t\t\t\t | contextualize_option\n\t\t\t\t\t\t\t\t | emptycontextualize_option : OPTION VAR comparator STRING\n\t\t\t\t\t\t\t\t| OPTION VAR comparator NUMBERcontextualize_items : contextualize_items contextualize_item \n\t\t                       | contextualize_item\n\t\t                       | emptycontextualize_item : SYSTEM VAR CONFIGURE VAR\n\t\t                      | SYSTEM VAR CONFIGURE VAR STEP NUMBERcfeatures_sentence : reference\n\t\t                      | nvar VAR LPAREN features RPARENfeatures : features AND feature\n\t\t            | feature\n\t\t            | emptyfeature : feature_soft\n\t\t           | feature_simple\n\t\t           | feature_featuresfeature_soft : SOFT NUMBER LPAREN features RPARENfeature_simple : VAR comparator NUMBER VAR\n\t\t                  | VAR comparator NUMBER\n\t\t                  | VAR comparator STRING\n\t\t                  | VAR comparator referencefeature_features : VAR CONTAINS LPAREN features RPARENreference : nvar VARnvar : SYSTEM\n\t\t        | VAREND : newlineempty :comparator : EQ\n\t\t              | LT\n\t\t              | GT\n\t\t              | GE\n\t\t              | LE\n\t\t              | CONTAINS'
+    
+_lr_action_items = {'newline':([0,1,2,3,4,5,6,7,8,9,14,17,18,19,23,30,40,51,64,72,80,],[9,9,-2,9,-4,-5,-6,-7,-8,-44,-27,-1,-3,-9,-41,-13,-14,-15,-28,-16,-10,]),'CONFIGURE':([0,1,2,4,9,17,18,53,],[10,10,-2,-4,-44,-1,-3,69,]),'CONTEXTUALIZE':([0,1,2,4,9,17,18,],[12,12,-2,-4,-44,-1,-3,]),'DEPLOY':([0,1,2,4,9,17,18,],[13,13,-2,-4,-44,-1,-3,]),'SYSTEM':([0,1,2,4,9,17,18,20,25,26,27,29,33,34,35,36,39,52,55,56,57,58,59,61,62,63,70,71,81,89,],[16,16,-2,-4,-44,-1,-3,-45,37,-18,-19,-45,37,-17,-23,-24,37,-22,-46,-47,-48,-49,-50,37,16,-51,-20,-21,-25,-26,]),'VAR':([0,1,2,4,9,10,11,13,15,16,17,18,28,30,31,37,55,56,57,58,59,62,63,65,69,73,76,77,79,],[11,11,-2,-4,-44,19,-43,22,23,-42,-1,-3,38,40,41,53,-46,-47,-48,-49,-50,11,-51,41,81,82,83,41,41,]),'$end':([1,2,4,9,17,18,],[0,-2,-4,-44,-1,-3,]),'LPAREN':([12,19,21,23,63,66,],[20,24,29,31,77,79,]),'NUMBER':([12,22,48,54,55,56,57,58,59,60,62,63,86,],[21,30,66,71,-46,-47,-48,-49,-50,-51,73,-51,89,]),'OPTION':([20,25,26,27,29,34,39,70,71,],[28,28,-18,-19,28,-17,28,-20,-21,]),'RPAREN':([20,25,26,27,29,31,33,34,35,36,39,42,43,44,45,46,47,52,61,67,70,71,73,74,75,77,78,79,81,82,83,84,85,87,88,89,],[-45,-45,-18,-19,-45,-45,51,-17,-23,-24,-45,64,-30,-31,-32,-33,-34,-22,72,80,-20,-21,-37,-38,-39,-45,-29,-45,-25,-36,-41,87,88,-40,-35,-26,]),'RECIPE_BEGIN':([24,],[32,]),'AND':([31,42,43,44,45,46,47,73,74,75,77,78,79,82,83,84,85,87,88,],[-45,65,-30,-31,-32,-33,-34,-37,-38,-39,-45,-29,-45,-36,-41,65,65,-40,-35,]),'SOFT':([31,65,77,79,],[48,48,48,48,]),'RECIPE_LINE':([32,49,50,68,],[50,68,-12,-11,]),'EQ':([38,41,],[55,55,]),'LT':([38,41,],[56,56,]),'GT':([38,41,],[57,57,]),'GE':([38,41,],[58,58,]),'LE':([38,41,],[59,59,]),'CONTAINS':([38,41,],[60,63,]),'RECIPE_END':([49,50,68,],[67,-12,-11,]),'STRING':([54,55,56,57,58,59,60,62,63,],[70,-46,-47,-48,-49,-50,-51,74,-51,]),'STEP':([81,],[86,]),}
+
+_lr_action = {}
+for _k, _v in _lr_action_items.items():
+   for _x,_y in zip(_v[0],_v[1]):
+      if not _x in _lr_action:  _lr_action[_x] = {}
+      _lr_action[_x][_k] = _y
+del _lr_action_items
+
+_lr_goto_items = {'radl':([0,],[1,]),'radl_sentence_end':([0,1,],[2,17,]),'radl_sentence':([0,1,],[3,3,]),'END':([0,1,3,],[4,4,18,]),'configure_sentence':([0,1,],[5,5,]),'contextualize_sentence':([0,1,],[6,6,]),'deploy_sentence':([0,1,],[7,7,]),'cfeatures_sentence':([0,1,],[8,8,]),'reference':([0,1,62,],[14,14,75,]),'nvar':([0,1,62,],[15,15,76,]),'contextualize_options':([20,29,],[25,39,]),'contextualize_option':([20,25,29,39,],[26,34,26,34,]),'empty':([20,25,29,31,39,77,79,],[27,36,27,44,36,44,44,]),'contextualize_items':([25,39,],[33,61,]),'contextualize_item':([25,33,39,61,],[35,52,35,52,]),'features':([31,77,79,],[42,84,85,]),'feature':([31,65,77,79,],[43,78,43,43,]),'feature_soft':([31,65,77,79,],[45,45,45,45,]),'feature_simple':([31,65,77,79,],[46,46,46,46,]),'feature_features':([31,65,77,79,],[47,47,47,47,]),'recipe':([32,],[49,]),'comparator':([38,41,],[54,62,]),}
+
+_lr_goto = {}
+for _k, _v in _lr_goto_items.items():
+   for _x, _y in zip(_v[0], _v[1]):
+       if not _x in _lr_goto: _lr_goto[_x] = {}
+       _lr_goto[_x][_k] = _y
+del _lr_goto_items
+_lr_productions = [
+  ("S' -> radl","S'",1,None,None,None),
+  ('radl -> radl radl_sentence_end','radl',2,'p_radl','radl_parse.py',183),
+  ('radl -> radl_sentence_end','radl',1,'p_radl','radl_parse.py',184),
+  ('radl_sentence_end -> radl_sentence END','radl_sentence_end',2,'p_radl_sentence_end','radl_parse.py',194),
+  ('radl_sentence_end -> END','radl_sentence_end',1,'p_radl_sentence_end','radl_parse.py',195),
+  ('radl_sentence -> configure_sentence','radl_sentence',1,'p_radl_sentence','radl_parse.py',200),
+  ('radl_sentence -> contextualize_sentence','radl_sentence',1,'p_radl_sentence','radl_parse.py',201),
+  ('radl_sentence -> deploy_sentence','radl_sentence',1,'p_radl_sentence','radl_parse.py',202),
+  ('radl_sentence -> cfeatures_sentence','radl_sentence',1,'p_radl_sentence','radl_parse.py',203),
+  ('configure_sentence -> CONFIGURE VAR','configure_sentence',2,'p_configure_sentence','radl_parse.py',207),
+  ('configure_sentence -> CONFIGURE VAR LPAREN RECIPE_BEGIN recipe RECIPE_END RPAREN','configure_sentence',7,'p_configure_sentence','radl_parse.py',208),
+  ('recipe -> recipe RECIPE_LINE','recipe',2,'p_recipe','radl_parse.py',222),
+  ('recipe -> RECIPE_LINE','recipe',1,'p_recipe','radl_parse.py',223),
+  ('deploy_sentence -> DEPLOY VAR NUMBER','deploy_sentence',3,'p_deploy_sentence','radl_parse.py',231),
+  ('deploy_sentence -> DEPLOY VAR NUMBER VAR','deploy_sentence',4,'p_deploy_sentence','radl_parse.py',232),
+  ('contextualize_sentence -> CONTEXTUALIZE LPAREN contextualize_options contextualize_items RPAREN','contextualize_sentence',5,'p_contextualize_sentence','radl_parse.py',240),
+  ('contextualize_sentence -> CONTEXTUALIZE NUMBER LPAREN contextualize_options contextualize_items RPAREN','contextualize_sentence',6,'p_contextualize_sentence','radl_parse.py',241),
+  ('contextualize_options -> contextualize_options contextualize_option','contextualize_options',2,'p_contextualize_options','radl_parse.py',251),
+  ('contextualize_options -> contextualize_option','contextualize_options',1,'p_contextualize_options','radl_parse.py',252),
+  ('contextualize_options -> empty','contextualize_options',1,'p_contextualize_options','radl_parse.py',253),
+  ('contextualize_option -> OPTION VAR comparator STRING','contextualize_option',4,'p_contextualize_option','radl_parse.py',263),
+  ('contextualize_option -> OPTION VAR comparator NUMBER','contextualize_option',4,'p_contextualize_option','radl_parse.py',264),
+  ('contextualize_items -> contextualize_items contextualize_item','contextualize_items',2,'p_contextualize_items','radl_parse.py',269),
+  ('contextualize_items -> contextualize_item','contextualize_items',1,'p_contextualize_items','radl_parse.py',270),
+  ('contextualize_items -> empty','contextualize_items',1,'p_contextualize_items','radl_parse.py',271),
+  ('contextualize_item -> SYSTEM VAR CONFIGURE VAR','contextualize_item',4,'p_contextualize_item','radl_parse.py',282),
+  ('contextualize_item -> SYSTEM VAR CONFIGURE VAR STEP NUMBER','contextualize_item',6,'p_contextualize_item','radl_parse.py',283),
+  ('cfeatures_sentence -> reference','cfeatures_sentence',1,'p_cfeatures_sentence','radl_parse.py',291),
+  ('cfeatures_sentence -> nvar VAR LPAREN features RPAREN','cfeatures_sentence',5,'p_cfeatures_sentence','radl_parse.py',292),
+  ('features -> features AND feature','features',3,'p_features','radl_parse.py',304),
+  ('features -> feature','features',1,'p_features','radl_parse.py',305),
+  ('features -> empty','features',1,'p_features','radl_parse.py',306),
+  ('feature -> feature_soft','feature',1,'p_feature','radl_parse.py',317),
+  ('feature -> feature_simple','feature',1,'p_feature','radl_parse.py',318),
+  ('feature -> feature_features','feature',1,'p_feature','radl_parse.py',319),
+  ('feature_soft -> SOFT NUMBER LPAREN features RPAREN','feature_soft',5,'p_feature_soft','radl_parse.py',324),
+  ('feature_simple -> VAR comparator NUMBER VAR','feature_simple',4,'p_feature_simple','radl_parse.py',329),
+  ('feature_simple -> VAR comparator NUMBER','feature_simple',3,'p_feature_simple','radl_parse.py',330),
+  ('feature_simple -> VAR comparator STRING','feature_simple',3,'p_feature_simple','radl_parse.py',331),
+  ('feature_simple -> VAR comparator reference','feature_simple',3,'p_feature_simple','radl_parse.py',332),
+  ('feature_features -> VAR CONTAINS LPAREN features RPAREN','feature_features',5,'p_feature_features','radl_parse.py',337),
+  ('reference -> nvar VAR','reference',2,'p_reference','radl_parse.py',342),
+  ('nvar -> SYSTEM','nvar',1,'p_nvar','radl_parse.py',351),
+  ('nvar -> VAR','nvar',1,'p_nvar','radl_parse.py',352),
+  ('END -> newline','END',1,'p_END','radl_parse.py',357),
+  ('empty -> <empty>','empty',0,'p_empty','radl_parse.py',362),
+  ('comparator -> EQ','comparator',1,'p_comparator','radl_parse.py',367),
+  ('comparator -> LT','comparator',1,'p_comparator','radl_parse.py',368),
+  ('comparator -> GT','comparator',1,'p_comparator','radl_parse.py',369),
+  ('comparator -> GE','comparator',1,'p_comparator','radl_parse.py',370),
+  ('comparator -> LE','comparator',1,'p_comparator','radl_parse.py',371),
+  ('comparator -> CONTAINS','comparator',1,'p_comparator','radl_parse.py',372),
+]
@@ -0,0 +1,544 @@
+# radl_transcode - Transcoder between RADL text and RADL JSON.
+# Copyright (C) 2014 - GRyCAP - Universitat Politecnica de Valencia
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Transcode RADL text to RADL JSON and back without building the ``RADL``.
+
+The tokens of the text, or the maps of the JSON, are taken to maps shaped like
+``Features.props`` and written out in the other form in a single pass. The
+result is the same as going through the objects without checking them:
+``radl_to_json(x)`` returns ``radl_json.dump_radl(radl_parse.parse_radl(x))``,
+and ``json_to_radl(x)`` returns ``radl_parse.dump_radl`` of the aspects that
+``radl_json.parse_radl`` builds, but before it checks them. So, unlike
+``radl_json.parse_radl``, ``json_to_radl`` does not raise on a document that
+does not check, and it writes connections to networks as strings, like
+``net_interface.0.connection = 'publica'``, where the checked document writes
+``network publica``. The values that the objects keep in a set, like several
+``outports contains``, are written in the order of ``sorted_features``, as the
+objects do.
+
+Documents that need the merging done by ``RADL.add`` and
+``Features.addFeature``, like the ones with references in features, with an
+aspect defined after a reference to it, or with properties in conflict, are
+transcoded through the objects, as are documents with syntax errors, so the
+errors raised are the same too.
+"""
+
+try:
+	import json
+except ImportError:
+	import simplejson as json
+try:
+	unicode("hola")
+except NameError:
+	class unicode: pass
+
+from .radl import Feature, Features, FeaturedAspect, RADL, SoftFeatures, RADLParseException, \
+                  UnitToValue, load_yaml, sorted_features
+from . import radl_parse
+from .radl_parse import yaml, _BLANK
+from .radl_fastparse import TokenStream, p_aspect_class, p_comparator
+from .radl_json import validate_simple, radlToSimple, p_aspect, _NotSimple
+
+SOFT = SoftFeatures.SOFT
+
+def radl_to_json(data, enter="\n", indent="  "):
+	"""
+	Transcode a RADL document from text to JSON.
+
+	Args.:
+	- data(str): RADL document in text.
+	- enter(str) and indent(str): as in ``radl_json.dump_radl``.
+
+	Return(str): the same text as ``dump_radl_json(parse_radl(data), enter, indent)``.
+	"""
+
+	indent = len(indent) if enter else None
+	sort_keys = indent is not None
+	separators = (",", ":" if indent is None else ": ")
+	return json.dumps(radl_to_simple(data), indent=indent, sort_keys=sort_keys, separators=separators)
+
+def radl_to_simple(data):
+	"""Return the same as ``dump_radl_simple(parse_radl(data))``."""
+
+	try:
+		return [ simple for _, _, simple in t_radl(TokenStream(data + "\n")) ]
+	except (_NotSimple, RADLParseException):
+		return radlToSimple(radl_parse.parse_radl(data))
+
+def json_to_radl(data, enter="\n", margin="", indent="  "):
+	"""
+	Transcode a RADL document from JSON to text.
+
+	Args.:
+	- data(str or list): RADL document in JSON, or already decoded.
+	- enter(str), margin(str) and indent(str): as in ``radl_parse.dump_radl``.
+
+	Return(str): the same text as ``dump_radl`` of the document in ``data``
+	before it is checked.
+	"""
+
+	if not isinstance(data, list):
+		data = json.loads(data)
+	data = validate_simple(data)
+	try:
+		return (enter*2).join([ d_aspect(a, reference, enter, margin, indent)
+		                        for _, reference, a in s_radl(data) ])
+	except _NotSimple:
+		return radl_parse.dump_radl(RADL([ p_aspect(a) for a in data ], check=False), enter, margin, indent)
+
+def add_aspect(aspects, keys, key, reference, value):
+	"""
+	Add an aspect like ``RADL.add``, but raise ``_NotSimple`` where that merges
+	or fails.
+
+	Args.:
+	- aspects(list): ``(key, reference, value)`` of the aspects added so far.
+	- keys(set): keys in ``aspects``.
+	- key: key of the aspect, or None if every aspect is new, like ``deploy``.
+	- reference(bool): whether the aspect is only a reference.
+	- value: what is kept of the aspect.
+	"""
+
+	if key is not None and key in keys:
+		if not reference:
+			raise _NotSimple()
+		return
+	if key is not None:
+		keys.add(key)
+	aspects.append((key, reference, value))
+
+def add_feature(props, f):
+	"""
+	Add a feature to ``props`` like ``Features.addFeature``, but raise
+	``_NotSimple`` where that merges or fails.
+
+	The value of features with other features, like the ones in ``contains``
+	and ``soft``, are maps like ``props`` and not ``Features``.
+	"""
+
+	value = f.value
+	if isinstance(value, bool):
+		raise _NotSimple()
+	if isinstance(value, int):
+		if f.operator == "=":
+			inter1 = (f, f)
+		elif f.operator[0] == "<":
+			inter1 = (None, f)
+		elif f.operator[0] == ">":
+			inter1 = (f, None)
+		else:
+			raise _NotSimple()
+		inter0 = props.get(f.prop, (None, None))
+		if not isinstance(inter0, tuple):
+			raise _NotSimple()
+		try:
+			props[f.prop] = Features._applyInter(inter0, inter1, "error")
+		except Exception:
+			raise _NotSimple()
+	elif f.prop == SOFT:
+		# Several soft blocks are in a set, in no particular order
+		if f.prop in props or f.operator != "soft":
+			raise _NotSimple()
+		props[f.prop] = [f]
+	elif f.operator == "contains":
+		values, key = props.get(f.prop), features_key(value) if isinstance(value, dict) else None
+		if key is not None:
+			if values is None:
+				values = props[f.prop] = {}
+			elif not isinstance(values, dict) or key in values:
+				raise _NotSimple()
+			values[key] = f
+		elif values is None:
+			props[f.prop] = [f]
+		elif isinstance(values, list) and is_scalar(f) and all(is_scalar(i) for i in values):
+			# Values without key are in a set, so sort them like the objects
+			if all(i.value != value for i in values):
+				values[:] = sorted_features(values + [f])
+		else:
+			raise _NotSimple()
+	elif isinstance(value, dict):
+		raise _NotSimple()
+	else:
+		value0 = props.get(f.prop)
+		if value0 is None:
+			f.operator = "="
+			props[f.prop] = f
+		elif not isinstance(value0, Feature) or value0.value != value:
+			raise _NotSimple()
+
+def is_scalar(f):
+	return not f.unit and not isinstance(f.value, dict)
+
+def features_key(props):
+	"""Return what ``Features.getKey`` returns on features with these ``props``."""
+
+	if "class" in props:
+		raise _NotSimple()
+	for prop in ("id", "name"):
+		f = props.get(prop)
+		if f is None:
+			continue
+		if not isinstance(f, Feature) or not isinstance(f.value, str):
+			raise _NotSimple()
+		if f.value or prop == "name":
+			return f.value
+	return None
+
+def soft_feature(soft, props):
+	"""Return a feature with a ``soft`` block; ``unit`` keeps the weight."""
+
+	return Feature(SOFT, "soft", props, soft)
+
+# Text to JSON: the ``t_*`` functions follow the ones in ``radl_fastparse``,
+# and return ``(key, reference, simple)`` for every aspect.
+
+def t_radl(ts):
+	aspects, keys = [], set()
+	while ts.tok is not None:
+		if ts.type() == "newline":
+			ts.expect("newline")
+			continue
+		aspect = t_radl_sentence(ts)
+		ts.expect("newline")
+		if aspect is not None:
+			add_aspect(aspects, keys, *aspect)
+	return aspects
+
+def t_radl_sentence(ts):
+	t = ts.type()
+	if t == "CONFIGURE":
+		return t_configure_sentence(ts)
+	elif t == "CONTEXTUALIZE":
+		return t_contextualize_sentence(ts)
+	elif t == "DEPLOY":
+		return t_deploy_sentence(ts)
+	return t_cfeatures_sentence(ts)
+
+def t_configure_sentence(ts):
+	ts.expect("CONFIGURE")
+	name = ts.expect("VAR")[1]
+	reference = { "class": "configure", "id": name, "reference": True }
+	if ts.type() != "LPAREN":
+		return ("configure", name), True, reference
+	ts.expect("LPAREN")
+	ts.expect("RECIPE_BEGIN")
+	_, text, line, _ = ts.expect("RECIPE")
+	ts.expect("RECIPE_END")
+	ts.expect("RPAREN")
+	try:
+		recipe = load_yaml(text)
+	except Exception as e:
+		raise RADLParseException("Error parsing YAML: %s" % str(e), line=line)
+	if not recipe:
+		return ("configure", name), False, reference
+	return ("configure", name), False, { "class": "configure", "id": name, "recipe": recipe }
+
+def t_deploy_sentence(ts):
+	ts.expect("DEPLOY")
+	r = { "class": "deploy", "system": ts.expect("VAR")[1], "vm_number": ts.expect("NUMBER")[1] }
+	if ts.type() == "VAR":
+		cloud = ts.expect("VAR")[1]
+		if cloud: r["cloud"] = cloud
+	return None, False, r
+
+def t_contextualize_sentence(ts):
+	ts.expect("CONTEXTUALIZE")
+	max_time = ts.expect("NUMBER")[1] if ts.type() == "NUMBER" else 0
+	ts.expect("LPAREN")
+	options = {}
+	while ts.type() == "OPTION":
+		ts.expect("OPTION")
+		prop = ts.expect("VAR")[1]
+		operator = p_comparator(ts)
+		options[prop] = Feature(prop, operator, ts.expect("STRING", "NUMBER")[1])
+	items, seen = [], set()
+	while ts.type() == "SYSTEM":
+		ts.expect("SYSTEM")
+		item = { "system": ts.expect("VAR")[1] }
+		ts.expect("CONFIGURE")
+		item["configure"] = ts.expect("VAR")[1]
+		if ts.type() == "STEP":
+			ts.expect("STEP")
+			step = ts.expect("NUMBER")[1]
+			if step: item["step"] = step
+		key = (item["system"], item["configure"], item.get("step", 0))
+		if key not in seen:
+			seen.add(key)
+			items.append(item)
+	ts.expect("RPAREN")
+	if not items and not options:
+		# Empty, so ``parse_radl`` does not add it
+		return None
+	r = { "class": "contextualize" }
+	if max_time: r["max_time"] = max_time
+	r["items"] = items
+	if options:
+		props = {}
+		for f in options.values():
+			add_feature(props, f)
+		r["options"] = props_to_simple(props)
+	return "contextualize", False, r
+
+def t_cfeatures_sentence(ts):
+	_, cls, line, _ = ts.expect("SYSTEM", "VAR")
+	name = ts.expect("VAR")[1]
+	cls = p_aspect_class(cls, line)
+	if not isinstance(cls, type) or not issubclass(cls, FeaturedAspect):
+		raise _NotSimple()
+	key = (cls.__name__, name)
+	r = { "class": cls.__name__, "id": name }
+	if ts.type() != "LPAREN":
+		r["reference"] = True
+		return key, True, r
+	ts.expect("LPAREN")
+	props = t_features(ts)
+	ts.expect("RPAREN")
+	if "class" in props:
+		# It would change the key of the aspect
+		raise _NotSimple()
+	r.update(props_to_simple(props))
+	return key, False, r
+
+def t_features(ts):
+	props = {}
+	if ts.type() not in ("AND", "RPAREN"):
+		t_feature(ts, props)
+	while ts.type() == "AND":
+		ts.expect("AND")
+		t_feature(ts, props)
+	return props
+
+def t_feature(ts, props):
+	if ts.type() == "SOFT":
+		ts.expect("SOFT")
+		soft = ts.expect("NUMBER")[1]
+		ts.expect("LPAREN")
+		features = t_features(ts)
+		ts.expect("RPAREN")
+		return add_feature(props, soft_feature(soft, features))
+	prop = ts.expect("VAR")[1]
+	if prop == SOFT:
+		raise _NotSimple()
+	operator = p_comparator(ts)
+	t = ts.type()
+	if operator == "contains" and t == "LPAREN":
+		ts.expect("LPAREN")
+		features = t_features(ts)
+		ts.expect("RPAREN")
+		return add_feature(props, Feature(prop, operator, features))
+	elif t == "NUMBER":
+		value = ts.expect("NUMBER")[1]
+		unit = ts.expect("VAR")[1] if ts.type() == "VAR" else None
+		return add_feature(props, Feature(prop, operator, value, unit))
+	elif t == "STRING":
+		return add_feature(props, Feature(prop, operator, ts.expect("STRING")[1], None))
+	# References to other aspects are added to the document by ``RADL.add``
+	ts.expect("SYSTEM", "VAR")
+	ts.expect("VAR")
+	raise _NotSimple()
+
+def props_to_simple(props):
+	"""Return the same as ``radl_json.featuresToSimple`` on features with these ``props``."""
+
+	r = {}
+	for k, v in props.items():
+		if k == SOFT:
+			r["softs"] = [ {"weight": i.unit, "items": props_to_simple(i.value)} for i in v ]
+		elif isinstance(v, tuple):
+			r[k+"_min"] = "-inf" if v[0] is None else value_to_simple(v[0])
+			r[k+"_max"] = "inf" if v[1] is None else value_to_simple(v[1])
+		elif isinstance(v, list):
+			r[k] = [ value_to_simple(i) for i in v ]
+		elif isinstance(v, dict):
+			r[k] = [ value_to_simple(i) for i in v.values() ]
+		else:
+			r[k] = value_to_simple(v)
+	return r
+
+def value_to_simple(f):
+	if isinstance(f.value, dict):
+		return props_to_simple(f.value)
+	if isinstance(f.value, (int, float)) and f.unit:
+		return f.value * UnitToValue(f.unit)
+	return f.value
+
+# JSON to text: the ``s_*`` functions follow the ``p_*`` ones in ``radl_json``
+# and return ``(key, reference, aspect)``, with the features of the aspects in
+# maps like ``props``; the ``d_*`` functions follow the ones in ``radl_parse``.
+
+def s_radl(data):
+	aspects, keys = [], set()
+	for a in data:
+		add_aspect(aspects, keys, *s_aspect(a))
+	return aspects
+
+def s_aspect(a):
+	cls = a["class"]
+	if cls == "configure":
+		return ("configure", a["id"]), bool(a.get("reference", False)), a
+	elif cls == "contextualize":
+		return "contextualize", False, a
+	elif cls == "deploy":
+		return None, False, a
+	cls = getattr(radl_parse.radl, cls, None)
+	if not isinstance(cls, type) or not issubclass(cls, FeaturedAspect):
+		raise _NotSimple()
+	if a.get("reference", False):
+		return (cls.__name__, a["id"]), True, (cls, a["id"], None)
+	return (cls.__name__, a["id"]), False, (cls, a["id"], s_features(a))
+
+def s_features(a):
+	props = {}
+	for f in s_feature_list(a):
+		add_feature(props, f)
+	return props
+
+def s_feature_list(a):
+	"""Return the features that ``radl_json.p_features`` returns."""
+
+	r = []
+	for k, v in a.items():
+		if k == "class" or k == "id":
+			continue
+		if k == SOFT or isinstance(v, bool):
+			raise _NotSimple()
+		if k == "softs":
+			if not isinstance(v, list) or not all(isinstance(i, dict) for i in v):
+				raise _NotSimple()
+			r.extend([ soft_feature(s_number(i.get("weight", 0)), s_features(s_dict(i.get("items", {}))))
+			           for i in v ])
+		elif k.endswith("_min") and isinstance(v, (int, float)):
+			r.append(Feature(k[0:-4], ">=", v))
+		elif k.endswith("_max") and isinstance(v, (int, float)):
+			r.append(Feature(k[0:-4], "<=", v))
+		elif isinstance(v, list):
+			r.extend([ Feature(k, "contains", s_value(i)) for i in v ])
+		else:
+			r.append(Feature(k, "=", s_value(v)))
+	return r
+
+def s_value(v):
+	if isinstance(v, bool):
+		raise _NotSimple()
+	if isinstance(v, (int, float, str)):
+		return v
+	if isinstance(v, dict) and "class" not in v:
+		return s_features(v)
+	# References and aspects, which ``RADL`` would add
+	raise _NotSimple()
+
+def s_number(v):
+	if isinstance(v, bool) or not isinstance(v, (int, float)):
+		raise _NotSimple()
+	return v
+
+def s_dict(v):
+	if not isinstance(v, dict):
+		raise _NotSimple()
+	return v
+
+def d_aspect(a, reference, enter, margin, indent):
+	if isinstance(a, tuple):
+		return d_cfeatures_sentence(a, reference, enter, margin, indent)
+	cls = a["class"]
+	if cls == "configure":
+		return d_configure_sentence(a, reference, enter, margin, indent)
+	elif cls == "contextualize":
+		return d_contextualize_sentence(a, enter, margin, indent)
+	return "{margin}deploy {id} {number}{cloud}".format(
+		margin=margin, id=a["system"], number=a["vm_number"],
+		cloud=" " + a["cloud"] if a.get("cloud") else "")
+
+def d_configure_sentence(a, reference, enter, margin, indent):
+	recipe = None if reference else a["recipe"]
+	if isinstance(recipe, str):
+		start, end = 0, len(recipe)
+		while start < end and recipe[start] == "\n": start += 1
+		while end > start and recipe[end-1] == "\n": end -= 1
+		if _BLANK.match(recipe, start, end):
+			recipe = None
+		else:
+			recipe = recipe[start:end]
+	elif recipe:
+		recipe = yaml.safe_dump(recipe, default_flow_style=False) if yaml else str(recipe)
+	if not recipe:
+		return "%sconfigure %s" % (margin, a["id"])
+	return "{margin}configure {name} ({enter}@begin{enter}{recipe}{enter}@end{enter}{margin})".format(
+		name=a["id"], enter=enter, margin=margin, recipe=recipe)
+
+def d_contextualize_sentence(a, enter, margin, indent):
+	max_time = a.get("max_time", 0)
+	options = {}
+	for f in s_feature_list(s_dict(a.get("options", {}))):
+		if isinstance(f.value, dict) or f.prop == SOFT:
+			raise _NotSimple()
+		options[f.prop] = f
+	items, seen = [], set()
+	for i in a.get("items", []):
+		key = (i["system"], i["configure"], i.get("step", 0))
+		if key not in seen:
+			seen.add(key)
+			items.append("{margin}system {sys} configure {conf}{num}".format(
+				margin=margin+indent, sys=key[0], conf=key[1], num=" step %d" % key[2] if key[2] else ""))
+	r = [ "{margin}contextualize {number}({enter}".format(
+		enter=enter, margin=margin, number="%d " % max_time if max_time else "") ]
+	r.append(enter.join([ "%soption %s" % (margin+indent, d_feature(f, enter, margin+indent, indent))
+	                      for f in options.values() ]))
+	if options: r.append(enter)
+	r.append(enter.join(items))
+	r.append(enter + margin + ")")
+	return "".join(r)
+
+def d_cfeatures_sentence(a, reference, enter, margin, indent):
+	cls, name, props = a
+	if reference:
+		return "{margin}{cls} {id}".format(margin=margin, cls=cls.__name__, id=name)
+	return "{margin}{cls} {id} ({enter}{features}{enter}{margin})".format(
+		margin=margin, cls=cls.__name__, id=name, enter=enter,
+		features=d_features(props, enter, margin+indent, indent))
+
+def d_features(props, enter, margin, indent):
+	"""Return the text of the features in the order of ``Features.features``."""
+
+	r = []
+	for v in props.values():
+		if isinstance(v, tuple):
+			if (v[0] and v[1] and v[0].getValue() == v[1].getValue() and
+			    v[0].operator == "=" and v[1].operator == "="):
+				v = [v[0]]
+			else:
+				v = [ f for f in v if f ]
+		elif isinstance(v, dict):
+			v = v.values()
+		elif not isinstance(v, list):
+			v = [v]
+		r.extend([ d_feature(f, enter, margin, indent) for f in v ])
+	return (" and%s" % enter).join(r)
+
+def d_feature(f, enter, margin, indent):
+	if f.prop == SOFT:
+		return "{margin}soft {soft} ({enter}{features}{enter}{margin})".format(
+			margin=margin, enter=enter, soft=f.unit, features=d_features(f.value, enter, margin+indent, indent))
+	elif isinstance(f.value, dict):
+		return "{margin}{prop} {op} ({enter}{features}{enter}{margin})".format(
+			margin=margin, enter=enter, prop=f.prop, op=f.operator,
+			features=d_features(f.value, enter, margin+indent, indent))
+	elif isinstance(f.value, (str, unicode)):
+		return "{margin}{prop} {op} '{val}'".format(margin=margin, prop=f.prop, op=f.operator,
+			val=f.value.replace("'", "\\'"))
+	return "{margin}{prop} {op} {val}".format(margin=margin, prop=f.prop, op=f.operator,
+		val="%s%s" % (f.value, f.unit if f.unit else ""))
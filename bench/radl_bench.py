@@ -0,0 +1,475 @@
+#!/usr/bin/env python
+# radl_bench - Benchmarks for module ``radl``.
+# Copyright (C) 2014 - GRyCAP - Universitat Politecnica de Valencia
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks for the RADL parser and object model.
+
+Usage: python bench/radl_bench.py [benchmark ...]
+
+Without arguments all benchmarks are run.
+"""
+
+import copy
+import io
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import ec3  # registers the ``include`` and ``description`` aspects
+from IM2.radl import radl, radl_parse, radl_fastparse
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "templates")
+
+BENCHMARKS = OrderedDict()
+
+def benchmark(f):
+	"""Register a benchmark."""
+
+	BENCHMARKS[f.__name__[len("bench_"):]] = f
+	return f
+
+def templates():
+	"""Return the content of the shipped templates sorted by name."""
+
+	r = []
+	for f in sorted(os.listdir(TEMPLATES_DIR)):
+		if f.endswith(".radl"):
+			with open(os.path.join(TEMPLATES_DIR, f)) as fd:
+				r.append((f, fd.read()))
+	return r
+
+def large_radl(systems=4, recipe_lines=200, output_lines=5000):
+	"""Return a RADL like the ones the IM returns for a big cluster."""
+
+	recipe = "\n".join([ "  - name: task %d\n    shell: echo %d" % (i, i) for i in range(recipe_lines) ])
+	output = "\\n".join([ "TASK [task %d] ok: [front] => {\"changed\": false}" % i for i in range(output_lines) ])
+	r = ["network public (outbound = 'yes' and outports = '22/tcp-22/tcp,8800/tcp-8800/tcp')",
+	     "network private ()"]
+	for i in range(systems):
+		r.append("""system node%d (
+cpu.count >= 2 and
+memory.size >= 2048m and
+state = 'configured' and
+net_interface.0.connection = 'public' and
+net_interface.0.ip = '10.0.0.%d' and
+net_interface.1.connection = 'private' and
+disk.0.image.url = 'one://server:2633/1' and
+disk.0.os.credentials.username = 'ubuntu' and
+disk.0.os.credentials.password = 'secret' and
+contextualization_output = '%s'
+)""" % (i, i, output))
+		r.append("configure node%d (\n@begin\n---\n%s\n@end\n)" % (i, recipe))
+		r.append("deploy node%d 1" % i)
+	return "\n\n".join(r)
+
+def best_time(f, repeat=3, number=1):
+	"""Return the best time in seconds of calling ``f`` ``number`` times."""
+
+	times = []
+	for _ in range(repeat):
+		time0 = time.time()
+		for _ in range(number):
+			f()
+		times.append(time.time() - time0)
+	return min(times)
+
+def report(name, seconds, count, unit="doc"):
+	print("  %-40s %10.3f ms/%s" % (name, seconds * 1000. / count, unit))
+
+@benchmark
+def bench_parser_setup():
+	"""Per-document cost of parsing every template with a new parser against the shared one."""
+
+	docs = [ c for _, c in templates() ]
+	def fresh():
+		for c in docs: radl_parse.RADLParser().parse(c)
+	def shared():
+		for c in docs: radl_parse.parse_radl(c)
+	report("new RADLParser per document", best_time(fresh), len(docs))
+	report("shared parser", best_time(shared), len(docs))
+
+@benchmark
+def bench_parse_engines():
+	"""Cost of parse_radl with the PLY and the hand-written engines."""
+
+	docs = [ c for _, c in templates() ]
+	for engine in ("ply", "fast"):
+		report("templates, engine=%s" % engine,
+		       best_time(lambda: [ radl_parse.parse_radl(c, engine=engine) for c in docs ]), len(docs))
+	data = large_radl()
+	for engine in ("ply", "fast"):
+		report("%d KB document, engine=%s" % (len(data) // 1024, engine),
+		       best_time(lambda: radl_parse.parse_radl(data, engine=engine)), 1)
+
+@benchmark
+def bench_parse_iter():
+	"""Cost of reading a document with parse_radl_iter, whole or up to the first system."""
+
+	data = large_radl()
+	def first_system():
+		for a in radl_fastparse.parse_radl_iter(io.StringIO(data)):
+			if isinstance(a, radl.system): return a
+	name = "%d KB document" % (len(data) // 1024)
+	report(name + ", parse_radl", best_time(lambda: radl_parse.parse_radl(data, engine="fast")), 1)
+	report(name + ", parse_radl_iter",
+	       best_time(lambda: list(radl_fastparse.parse_radl_iter(io.StringIO(data)))), 1)
+	report(name + ", parse_radl_iter up to the first system",
+	       best_time(first_system), 1)
+
+@benchmark
+def bench_parse_select():
+	"""Cost of loading only the features of a system that 'ec3 list' shows."""
+
+	data = large_radl()
+	name = "%d KB document" % (len(data) // 1024)
+	report(name + ", whole", best_time(lambda: radl_parse.parse_radl(data, engine="fast")), 1)
+	report(name + ", system node0 and networks",
+	       best_time(lambda: radl_parse.parse_radl(data, aspects=("system node0", "network"),
+	                                               features=("state", "net_interface", "outbound"))), 1)
+
+@benchmark
+def bench_dump_memory():
+	"""Peak memory of writing a large RADL to a file with dump_radl and dump_radl_to."""
+
+	try:
+		import tracemalloc
+	except ImportError:
+		print("  tracemalloc is not available")
+		return
+	r = radl_parse.parse_radl(large_radl(output_lines=50000), engine="fast")
+	def write_dump(f):
+		f.write(radl_parse.dump_radl(r))
+	def write_dump_to(f):
+		radl_parse.dump_radl_to(f, r)
+	for name, write in (("dump_radl", write_dump), ("dump_radl_to", write_dump_to)):
+		with open(os.devnull, "w") as f:
+			tracemalloc.start()
+			write(f)
+			peak = tracemalloc.get_traced_memory()[1]
+			tracemalloc.stop()
+		print("  %-40s %9.1f KB" % (name, peak / 1024.))
+
+@benchmark
+def bench_save_cluster():
+	"""Cost of saving a cluster with ec3.dump_radl_to compared with only writing its text."""
+
+	r = radl_parse.parse_radl(large_radl(), engine="fast")
+	r.check()
+	def write(dump_to):
+		with open(os.devnull, "w") as f:
+			dump_to(f, r)
+	name = "%d KB cluster" % (len(radl_parse.dump_radl(r)) // 1024)
+	report(name + ", radl_parse.dump_radl_to", best_time(lambda: write(radl_parse.dump_radl_to)), 1)
+	report(name + ", ec3.dump_radl_to", best_time(lambda: write(ec3.dump_radl_to)), 1)
+
+@benchmark
+def bench_merge():
+	"""Cost of merging every template into one RADL, and a system into a large cluster."""
+
+	# RADL.merge without the final check(), as some templates are not complete on their own
+	def merge_all(clone):
+		r = radl.RADL()
+		for _, c in docs:
+			t = radl_parse.parse_radl(c, engine="fast")
+			if clone:
+				for self0 in (r.clone(check=False), r):
+					for a in t.aspects:
+						self0.add(a, "merge", missing="other", conflict="other")
+			else:
+				j = radl._Journal()
+				for a in t.aspects:
+					r.add(a, "merge", journal=j, missing="other", conflict="other")
+	docs = templates()
+	report("parse only", best_time(lambda: [ radl_parse.parse_radl(c, engine="fast") for _, c in docs ]),
+	       len(docs))
+	report("parse and merge, clone first", best_time(lambda: merge_all(True)), len(docs))
+	report("parse and merge, journal", best_time(lambda: merge_all(False)), len(docs))
+
+	r = radl_parse.parse_radl(large_radl(), engine="fast")
+	r.check()
+	s = radl_parse.parse_radl("system node0 ( cpu.count >= 2 and disk.0.os.name = 'linux' )").get(radl.system("node0"))
+	def add(clone):
+		if clone: r.clone(check=False).add(s, ifpresent="merge", missing="other", conflict="other")
+		r.add(s, ifpresent="merge", missing="other", conflict="other")
+	name = "system into a %d KB cluster" % (len(radl_parse.dump_radl(r)) // 1024)
+	report(name + ", clone first", best_time(lambda: add(True), number=20), 20, unit="add")
+	report(name + ", journal", best_time(lambda: add(False), number=20), 20, unit="add")
+
+@benchmark
+def bench_features_cache():
+	"""Cost of reading the features and the hash of a system with a few hundred features."""
+
+	s = radl.system("big", [ radl.Feature("disk.%d.%s" % (i, p), "=", "value %d" % i)
+	                         for i in range(100) for p in ("image.url", "os.name", "mount_path") ])
+	name = "system with %d features" % len(s.features)
+	def read(cached):
+		for _ in range(100):
+			if not cached: s._changed()
+			s.features
+			radl.Features.__hash__(s)
+	report(name + ", not cached", best_time(lambda: read(False)), 100, unit="read")
+	report(name + ", cached", best_time(lambda: read(True)), 100, unit="read")
+
+@benchmark
+def bench_object_memory():
+	"""Memory of a RADL with 1000 systems, and the part saved by slots and interned names."""
+
+	try:
+		import tracemalloc
+	except ImportError:
+		print("  tracemalloc is not available")
+		return
+	class DictFeature(object):
+		def __init__(self, prop, operator, value, unit='', line=None):
+			self.prop, self.operator, self.value, self.unit, self.line = prop, operator, value, unit, line
+	def traced(f):
+		tracemalloc.start()
+		r = f()
+		size = tracemalloc.get_traced_memory()[0]
+		tracemalloc.stop()
+		return r, size
+	data = large_radl(systems=1000, recipe_lines=1, output_lines=1)
+	r, size = traced(lambda: radl_parse.parse_radl(data, engine="fast"))
+	features = [ f for a in r.aspects if isinstance(a, radl.Features) for f in a.features ]
+	intern_name, radl.intern_name = radl.intern_name, lambda name: name
+	try:
+		size_no_intern = traced(lambda: radl_parse.parse_radl(data, engine="fast"))[1]
+	finally:
+		radl.intern_name = intern_name
+	size_slots = traced(lambda: [ radl.Feature(f.prop, f.operator, f.value, f.unit, f.line) for f in features ])[1]
+	size_dict = traced(lambda: [ DictFeature(f.prop, f.operator, f.value, f.unit, f.line) for f in features ])[1]
+	print("  %-40s %9.1f KB" % ("RADL with 1000 systems", size / 1024.))
+	print("  %-40s %9.1f KB" % ("saved by interning property names", (size_no_intern - size) / 1024.))
+	print("  %-40s %9.1f KB" % ("saved by slots in %d features" % len(features), (size_dict - size_slots) / 1024.))
+
+@benchmark
+def bench_clone():
+	"""Cost of RADL.clone on a large cluster, copying every aspect or sharing them until changed."""
+
+	def deepcopy_clone(r):
+		r0 = radl.RADL()
+		for a in r.aspects:
+			new_a = copy.deepcopy(a)
+			r0.props[new_a.getKey()] = new_a
+		for a in r0.aspects:
+			for f in (a.features if isinstance(a, radl.Features) else []):
+				if isinstance(f.value, radl.Aspect):
+					f.value = r0.get(f.value)
+		return r0
+	r = radl_parse.parse_radl(large_radl(systems=100, recipe_lines=50, output_lines=50), engine="fast")
+	r.check()
+	for c in r.gets(radl.configure): c.recipe
+	name = "%d KB cluster" % (len(radl_parse.dump_radl(r)) // 1024)
+	report(name + ", deepcopy", best_time(lambda: deepcopy_clone(r)), 1)
+	report(name + ", RADL.clone", best_time(lambda: r.clone(check=False)), 1)
+	report(name + ", RADL.clone and check", best_time(lambda: r.clone()), 1)
+
+@benchmark
+def bench_check():
+	"""Cost of RADL.check on the shipped templates and on a large cluster."""
+
+	docs = []
+	for _, c in templates():
+		r = radl_parse.parse_radl(c, engine="fast")
+		try:
+			r.check()
+		except radl.RADLParseException:
+			# Some templates refer to aspects defined in other templates
+			continue
+		docs.append(r)
+	report("%d templates" % len(docs), best_time(lambda: [ r.check() for r in docs ], number=20),
+	       20 * len(docs))
+	r = radl_parse.parse_radl(large_radl(systems=100, recipe_lines=5, output_lines=5), engine="fast")
+	r.check()
+	report("cluster with 100 systems", best_time(r.check, number=20), 20)
+
+@benchmark
+def bench_diff():
+	"""Cost of RADL.diff between two versions of a large cluster with one changed system."""
+
+	r0 = radl_parse.parse_radl(large_radl(systems=100, recipe_lines=50, output_lines=50), engine="fast")
+	r0.check()
+	r1 = r0.clone()
+	r1.get(radl.system("node5")).setValue("state", "running")
+	def compare_all():
+		# Previous implementation: compare every aspect feature by feature
+		return [ a for a in r1.aspects if a != r0.get(a) ]
+	name = "%d KB cluster" % (len(radl_parse.dump_radl(r0)) // 1024)
+	report(name + ", comparing every aspect", best_time(compare_all), 1)
+	report(name + ", fingerprints", best_time(lambda: r1.diff(r0)), 1)
+
+@benchmark
+def bench_alternatives():
+	"""Cost of enumerating the alternatives of a system with several weighted soft blocks."""
+
+	def product_alternatives(s):
+		# Previous implementation: clone and merge from scratch for every subset
+		soft = sorted(s.getValue(radl.SoftFeatures.SOFT, []), key=lambda f: f.soft, reverse=True)
+		for mask in itertools.product([True, False], repeat=len(soft)):
+			try:
+				s0 = s.clone()
+				[ s0.merge(fs, missing="other") for m, fs in zip(mask, soft) if m ]
+			except radl.RADLConflict:
+				pass
+			else:
+				yield s0
+	softs = " and ".join([ "soft %d ( instance_type = 'type%d' and cpu.count >= %d )" % (10 + i, i % 4, i)
+	                       for i in range(12) ])
+	s = radl_parse.parse_radl("system front ( disk.0.os.name = 'linux' and %s )" % softs).get(radl.system("front"))
+	name = "system with 12 soft blocks"
+	report(name + ", every subset", best_time(lambda: list(product_alternatives(s))), 1, unit="system")
+	report(name + ", depth-first", best_time(lambda: list(s.alternatives())), 1, unit="system")
+	report(name + ", concrete", best_time(lambda: s.concrete(), number=100), 100, unit="system")
+
+@benchmark
+def bench_recipe_merge():
+	"""Cost of merging and comparing the recipes of every template."""
+
+	def merge_yaml(me, other):
+		# Previous implementation: merge the decoded recipes and copy the result
+		if me == other: return me
+		if isinstance(me, list) and isinstance(other, list): return me + other
+		if not (isinstance(me, dict) and isinstance(other, dict)): return other
+		r = dict(other)
+		r.update([ (p, merge_yaml(v, other[p])) if p in other else (p, v) for p, v in me.items() ])
+		return r
+	confs = [ a for _, c in templates() for a in radl_parse.parse_radl(c, engine="fast").gets(radl.configure)
+	          if a.recipe_text is not None ]
+	recipes = [ c.recipe for c in confs ]
+	trees = [ radl.freeze_recipe(r) for r in recipes ]
+	def merge_all_copy():
+		r = []
+		for recipe in recipes:
+			r = copy.deepcopy(merge_yaml(r, recipe))
+		return r == copy.deepcopy(r)
+	def merge_all_tree():
+		r = radl.freeze_recipe([])
+		for tree in trees:
+			r = radl.configure._merge_yaml(r, tree, conflict="other")
+		return r == radl.freeze_recipe(radl.thaw_recipe(r))
+	name = "%d template recipes" % len(recipes)
+	report(name + ", decoded and copied", best_time(merge_all_copy, number=10), 10 * len(recipes), unit="merge")
+	report(name + ", hash-consed trees", best_time(merge_all_tree, number=10), 10 * len(recipes), unit="merge")
+
+@benchmark
+def bench_freeze():
+	"""Cost of giving several threads a RADL to read, copying it for each or sharing a snapshot."""
+
+	def read(r):
+		return [ (hash(a), a.fingerprint()) for a in r.aspects ]
+	def run(f, threads=8):
+		ts = [ threading.Thread(target=f) for _ in range(threads) ]
+		[ t.start() for t in ts ]
+		[ t.join() for t in ts ]
+	r = radl_parse.parse_radl(large_radl(systems=100, recipe_lines=50, output_lines=50), engine="fast")
+	r.check()
+	name = "%d KB cluster" % (len(radl_parse.dump_radl(r)) // 1024)
+	report(name + ", RADL.freeze", best_time(lambda: r.freeze()), 1)
+	name += ", 8 threads"
+	report(name + ", deepcopy each", best_time(lambda: run(lambda: read(copy.deepcopy(r)))), 1)
+	f = r.freeze()
+	report(name + ", share a snapshot", best_time(lambda: run(lambda: read(f))), 1)
+	report(name + ", thaw each", best_time(lambda: run(lambda: read(f.thaw()))), 1)
+
+@benchmark
+def bench_parse_json():
+	"""Cost of parse_radl_json on large multi-system documents, and of validating them."""
+
+	import jsonschema
+	from IM2.radl import radl_json
+	def validate_encode(data):
+		# Previous implementation: build the validator every time, and encode in another pass
+		jsonschema.validate(data, radl_json.radl_schema)
+		return radl_json.encode_simple(data)
+	for systems in (10, 100):
+		r = radl_parse.parse_radl(large_radl(systems=systems, recipe_lines=50, output_lines=50), engine="fast")
+		text = radl_json.dump_radl(r)
+		data = json.loads(text)
+		name = "%d systems, %d KB" % (systems, len(text) // 1024)
+		report(name + ", jsonschema.validate", best_time(lambda: validate_encode(data)), 1)
+		report(name + ", cached validator", best_time(lambda: radl_json.get_validator().validate(data)), 1)
+		report(name + ", validate_simple", best_time(lambda: radl_json.validate_simple(data)), 1)
+		report(name + ", parse_radl_json", best_time(lambda: radl_json.parse_radl(text)), 1)
+
+@benchmark
+def bench_dump_json():
+	"""Time and peak memory of writing a large RADL in JSON with dump_radl_json and dump_radl_json_to."""
+
+	from IM2.radl import radl_json
+	try:
+		import tracemalloc
+	except ImportError:
+		tracemalloc = None
+	r = radl_parse.parse_radl(large_radl(output_lines=50000), engine="fast")
+	for enter, mode in (("\n", "indented"), ("", "compact")):
+		def write_dump(f):
+			f.write(radl_json.dump_radl(r, enter=enter))
+		def write_dump_to(f):
+			radl_json.dump_radl_to(f, r, enter=enter)
+		for name, write in (("dump_radl_json", write_dump), ("dump_radl_json_to", write_dump_to)):
+			name = "%s, %s" % (name, mode)
+			with open(os.devnull, "w") as f:
+				report(name, best_time(lambda: write(f)), 1)
+				if tracemalloc:
+					tracemalloc.start()
+					write(f)
+					peak = tracemalloc.get_traced_memory()[1]
+					tracemalloc.stop()
+					print("  %-40s %9.1f KB" % (name + ", peak", peak / 1024.))
+
+@benchmark
+def bench_transcode():
+	"""Cost of radl_to_json and json_to_radl against the round trip through the RADL objects."""
+
+	from IM2.radl import radl_json, radl_transcode
+	def objects_to_text(j):
+		# What json_to_radl returns, with the document ``parse_radl_json`` builds before checking it
+		data = radl_json.validate_simple(json.loads(j))
+		return radl_parse.dump_radl(radl.RADL([ radl_json.p_aspect(a) for a in data ], check=False))
+	docs = [ ("templates", [ t for _, t in templates() ]) ]
+	# Most of the time of the documents with recipes goes to decoding and encoding them in YAML
+	docs.extend([ ("%d systems%s" % (systems, "" if recipe_lines else ", no recipes"),
+	               [ large_radl(systems=systems, recipe_lines=recipe_lines, output_lines=50) ])
+	              for systems, recipe_lines in ((10, 50), (100, 50), (100, 0)) ])
+	for name, texts in docs:
+		jsons = [ radl_json.dump_radl(radl_parse.parse_radl(t)) for t in texts ]
+		report(name + ", dump_radl_json(parse_radl)",
+		       best_time(lambda: [ radl_json.dump_radl(radl_parse.parse_radl(t)) for t in texts ]), len(texts))
+		report(name + ", radl_to_json", best_time(lambda: [ radl_transcode.radl_to_json(t) for t in texts ]),
+		       len(texts))
+		report(name + ", dump_radl(parse_radl_json)", best_time(lambda: [ objects_to_text(j) for j in jsons ]),
+		       len(texts))
+		report(name + ", json_to_radl", best_time(lambda: [ radl_transcode.json_to_radl(j) for j in jsons ]),
+		       len(texts))
+
+def main(names):
+	for name in (names or BENCHMARKS.keys()):
+		if name not in BENCHMARKS:
+			sys.stderr.write("Unknown benchmark '%s'; available: %s\n" % (name, ", ".join(BENCHMARKS)))
+			return 1
+		print("%s: %s" % (name, BENCHMARKS[name].__doc__.strip()))
+		BENCHMARKS[name]()
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
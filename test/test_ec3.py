@@ -14,9 +14,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import sys
+import shutil
+import tempfile
 import unittest
 import logging
+import json
 from mock import patch, MagicMock, mock_open
 from collections import namedtuple
 try:
@@ -30,10 +34,13 @@ except ImportError:
 
 sys.path.append("..")
 sys.path.append(".")
+from IM2.auth import Authentication
 
-from IM2.radl.radl import RADL, system, network
-from IM2.radl.radl_parse import parse_radl
-from ec3 import ClusterStore, CLI, CmdLaunch, CmdList, CmdTemplates, CmdDestroy, CmdReconfigure, CmdClone, CmdStop, CmdRestart, CmdSsh, CmdUpdate
+import IM2.radl.radl as IM_RADL
+from IM2.radl.radl import RADL, Feature, Features, system, network, deploy, configure
+from IM2.radl.radl_parse import parse_radl, dump_radl
+from IM2.radl.radl_json import dump_radl as dump_radl_json
+from ec3 import apply_ec3_expressions, dump_radl as ec3_dump_radl, dump_radl_to as ec3_dump_radl_to, display_radl, getPublicIP, get_out_port, ParseCache, ClusterStore, CLI, CmdLaunch, CmdList, CmdTemplates, CmdDestroy, CmdReconfigure, CmdClone, CmdStop, CmdRestart, CmdSsh, CmdUpdate
 
 cluster_data = """system front (
                     state = 'configured' and
@@ -69,8 +76,9 @@ class TestEC3(unittest.TestCase):
         radl.add(s)
         return radl, s
 
-    def get_response(self, method, url, verify, headers, data=None):
+    def get_response(self, method, url, verify, headers, data=None, stream=False):
         resp = MagicMock()
+        resp.iter_content.side_effect = lambda size: iter([resp.text])
         resp.status_code = 400
         parts = urlparse(url)
         url = parts[2]
@@ -140,6 +148,36 @@ class TestEC3(unittest.TestCase):
         sys.stdout = old_stdout
         self.assertEquals(res, " name    state       IP     nodes  provider  \n---------------------------------------------\n name  configured  8.8.8.8    1    OpenStack \n")
 
+    @patch('ec3.ClusterStore')
+    def test_list_json(self, cluster_store):
+        cluster_store.list.return_value = ["name"]
+        radl, _ = self.gen_radl()
+        cluster_store.load.return_value = radl
+        Options = namedtuple('Options', ['json', 'compact', 'refresh', 'username'])
+        info = [{"name": "name", "state": "configured", "IP": "8.8.8.8", "nodes": "1", "provider": "OpenStack"}]
+        for compact in (False, True):
+            options = Options(json=True, compact=compact, refresh=False, username=[''])
+            old_stdout = sys.stdout
+            sys.stdout = StringIO()
+            CmdList.run(options)
+            res = sys.stdout.getvalue()
+            sys.stdout = old_stdout
+            self.assertEqual(json.loads(res), info)
+            self.assertEqual(res.count("\n"), 1 if compact else 9)
+
+    def test_show_json(self):
+        radl, _ = self.gen_radl()
+        radl.get(system("front")).setValue("contextualization_output", "log line\n" * 20000)
+        CLI.logger = logging.getLogger('ec3')
+        CLI.options = namedtuple('Options', ['quiet'])(quiet=False)
+        for compact in (False, True):
+            old_stdout = sys.stdout
+            sys.stdout = StringIO()
+            display_radl(radl, True, compact)
+            res = sys.stdout.getvalue()
+            sys.stdout = old_stdout
+            self.assertEqual(res, dump_radl_json(radl, enter="" if compact else "\n") + "\n\n")
+
     @patch('ec3.ClusterStore')
     @patch('ec3.CLI.display')
     @patch('requests.request')
@@ -150,12 +188,12 @@ class TestEC3(unittest.TestCase):
         CLI.options = cli_options
         cluster_store.list.return_value = ["name"]
         Options = namedtuple('Options', ['not_store', 'clustername', 'auth_file', 'restapi', 'dry_run', 'templates',
-                                         'add', 'golden_image', 'print_radl', 'json', 'yes', 'destroy'])
+                                         'add', 'golden_image', 'print_radl', 'json', 'compact', 'yes', 'destroy'])
         auth_file = [MagicMock()]
         auth_file[0].readlines.return_value = ["type = InfrastructureManager; username = user; password = pass"]
         options = Options(not_store=False, clustername="name", auth_file=auth_file, restapi=['http://server.com:8800'],
                           dry_run=True, templates=['ubuntu-ec2','kubernetes'], add=False, golden_image=False,
-                          print_radl=True, json=False, yes=True, destroy=False)
+                          print_radl=True, json=False, compact=False, yes=True, destroy=False)
         with self.assertRaises(SystemExit) as ex1:
             CmdLaunch.run(options)
         self.assertEquals("1" ,str(ex1.exception))
@@ -355,7 +393,7 @@ deploy front 1
         requests.side_effect = self.get_response
         options = Options(not_store=False, clustername="name", auth_file=auth_file, restapi=['http://server.com:8800'],
                           dry_run=False, templates=['ubuntu-ec2','kubernetes'], add=False, golden_image=False,
-                          print_radl=False, json=False, yes=True, destroy=False)
+                          print_radl=False, json=False, compact=False, yes=True, destroy=False)
 
         with self.assertRaises(SystemExit) as ex2:
             CmdLaunch.run(options)
@@ -365,6 +403,29 @@ deploy front 1
         self.assertEquals(display.call_args_list[5][0][0], "Front-end configured with IP 8.8.8.8")
         self.assertEquals(display.call_args_list[6][0][0], "Transferring infrastructure")
         self.assertEquals(display.call_args_list[7][0][0], "Front-end ready!")
+        # The RADL submitted is stored to send later only what changes
+        post = [ c for c in requests.call_args_list if c[0][0] == "POST" ][0]
+        cluster_store.save_submitted.assert_called_once_with("name", post[1]['data'])
+
+    @patch('requests.request')
+    def test_get_front_vm_id(self, requests):
+        def chunks(size):
+            yield "network public (outbound='yes')\nsystem wn (memory.size >= 1g)\n"
+            yield "system front (cpu.count = 1)\n"
+            yield "system other (cpu.count = 1)\n"
+            raise AssertionError("read after the front-end")
+        def get_response(method, url, verify, headers, stream=False):
+            resp = MagicMock()
+            self.assertTrue(stream)
+            resp.status_code = 200
+            if url.endswith("/vms/1"):
+                resp.iter_content.side_effect = chunks
+            else:
+                resp.iter_content.side_effect = lambda size: iter(["system wn ( cpu.count = 1 )\n"])
+            return resp
+        requests.side_effect = get_response
+        self.assertEqual(CmdLaunch.get_front_vm_id("http://server.com", "infid", ["0", "1", "2"], []), "1")
+        self.assertEqual(requests.call_count, 2)
 
     def test_templates(self):
         Options = namedtuple('Options', ['search', 'name', 'json', 'full'])
@@ -378,6 +439,117 @@ deploy front 1
         self.assertIn("----------------------------------------------------------------------------------------------------------------------\n", res)
         self.assertIn("         galaxy           component Galaxy is an open, web-based platform for data intensive biomedical research.     \n", res)
 
+    def test_parse_cache(self):
+        content = open(os.path.join("templates", "slurm.radl")).read()
+        ParseCache.clear()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            ParseCache.DIR = tmpdir
+            with patch('ec3.parse_radl', wraps=parse_radl) as parse:
+                r0 = ParseCache.parse(content)
+                r0.get(system("front")).setValue("ec3_templates_cmd", "changed")
+                r1 = ParseCache.parse(content)
+                self.assertEqual(parse.call_count, 1)
+                self.assertIsNot(r0, r1)
+                self.assertIsNone(r1.get(system("front")).getValue("ec3_templates_cmd"))
+                self.assertEqual(dump_radl(r1), dump_radl(parse_radl(content)))
+                self.assertEqual(len(os.listdir(tmpdir)), 1)
+
+                # Another process reads the stored entry
+                ParseCache.clear()
+                r2 = ParseCache.parse(content)
+                self.assertEqual(parse.call_count, 1)
+                self.assertEqual(dump_radl(r2), dump_radl(r1))
+                ParseCache.parse(content + "\n")
+                self.assertEqual(parse.call_count, 2)
+
+                # Entries stored with another layout of the RADL classes are not reused
+                ParseCache.clear()
+                with patch('IM2.radl.radl.PICKLE_VERSION', IM_RADL.PICKLE_VERSION + 1):
+                    ParseCache.parse(content)
+                self.assertEqual(parse.call_count, 3)
+        finally:
+            ParseCache.DIR = None
+            ParseCache.clear()
+            shutil.rmtree(tmpdir)
+
+    def test_dump_radl(self):
+        radl, s = self.gen_radl()
+        s.addFeature(Feature("disk.0.applications", "contains", Features([Feature("name", "=", "app")])))
+        s.addFeature(Feature("ports", "contains", "22"))
+        s.addFeature(Feature("ports", "contains", "80"))
+        radl.add(deploy("wn", 2))
+        radl.add(deploy("front", 1))
+        before = str(radl)
+        with patch.object(RADL, 'clone', side_effect=AssertionError("cloned")):
+            out = ec3_dump_radl(radl, order_deploys=True)
+            f = StringIO()
+            ec3_dump_radl_to(f, radl, order_deploys=True)
+        self.assertEqual(f.getvalue(), out)
+        self.assertEqual(str(radl), before)
+        self.assertIn("net_interface.0.connection = 'public'", out)
+        self.assertIn("disk.0.applications contains (\n", out)
+        self.assertTrue("ports = '22,80'" in out or "ports = '80,22'" in out)
+        self.assertTrue(out.endswith("deploy front 1\n\ndeploy wn 2"))
+        self.assertEqual(ec3_dump_radl(radl, aspect=network("public")), "network public (\n  outbound = 'yes'\n)")
+
+        # Frozen RADLs are dumped the same
+        frozen = radl.freeze()
+        self.assertEqual(ec3_dump_radl(frozen, order_deploys=True), out)
+        f = StringIO()
+        ec3_dump_radl_to(f, frozen, order_deploys=True)
+        self.assertEqual(f.getvalue(), out)
+        self.assertEqual(ec3_dump_radl(frozen, order_deploys=True), out)
+
+    def test_apply_ec3_expressions(self):
+        radl = parse_radl("""
+system front ( disk.0.os.name = 'linux' )
+configure plain (
+@begin
+- tasks:
+  - shell: echo plain
+@end
+)
+configure prio (
+@begin
+- tasks:
+  - shell: echo last
+- ec3_prio: -1
+  tasks:
+  - shell: echo first
+@end
+)
+configure vars (
+@begin
+- vars:
+    OS:
+      ec3_xpath: /system/front/disk.0.os.name
+  tasks:
+  - shell: echo {{OS}}
+@end
+)
+""")
+        apply_ec3_expressions(radl)
+        # Only the recipes with variables computed by ec3 are decoded as lists
+        self.assertIsNotNone(radl.get(configure("plain"))._tree)
+        self.assertIsNotNone(radl.get(configure("prio"))._tree)
+        self.assertIsNone(radl.get(configure("vars"))._tree)
+        self.assertEqual(radl.get(configure("prio")).getRecipe(),
+                         [{"tasks": [{"shell": "echo first"}]}, {"tasks": [{"shell": "echo last"}]}])
+        self.assertEqual(radl.get(configure("vars")).recipe[0]["vars"]["OS"], "linux")
+        c = radl.get(configure("vars"))
+        self.assertIs(c.recipe_tree, c.recipe_tree)
+
+    def test_parse_engines(self):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "templates")
+        for t in sorted(os.listdir(path)):
+            if not t.endswith(".radl"): continue
+            with open(os.path.join(path, t)) as f:
+                content = f.read()
+            r0, r1 = parse_radl(content), parse_radl(content, engine="fast")
+            self.assertEqual(dump_radl(r0), dump_radl(r1), t)
+            self.assertEqual([ a.line for a in r0.aspects ], [ a.line for a in r1.aspects ], t)
+
     @patch('requests.request')
     @patch('ec3.ClusterStore')
     @patch('ec3.CLI.display')
@@ -417,7 +589,57 @@ deploy front 1
         self.assertIn(".ec3/clusters/cluster1", mo.call_args_list[-1][0][0])
         if sys.version_info < (3, 0):
             expected_res = """network public (\n  outbound = \'yes\'\n)\n\nsystem front (\n  net_interface.0.ip = \'8.8.8.8\' and\n  __infrastructure_id = \'infid\' and\n  auth = \'[{"type": "InfrastructureManager", "username": "user", "password": "pass"}]\' and\n  __im_server = \'http://server.com:8800\' and\n  net_interface.0.connection = \'public\' and\n  nodes = 1 and\n  contextualization_output = \'contmsg\'\n)"""
-            self.assertEqual(mo.mock_calls[-2][1][0], expected_res)
+            self.assertEqual("".join([ c[0][0] for c in mo().write.call_args_list ]), expected_res)
+
+    @patch('os.listdir')
+    @patch('os.makedirs')
+    @patch(open_name, new_callable=mock_open, read_data="""
+network public (outbound = 'yes' and outports = '2222/tcp-22/tcp')
+system wn (memory.size >= 1g)
+configure front (
+@begin
+  - not: [valid yaml
+@end
+)
+system front (
+  state = 'configured' and
+  __infrastructure_id = 'infid' and
+  net_interface.0.connection = 'public' and
+  net_interface.0.ip = '8.8.8.8' and
+  disk.0.os.credentials.username = 'user' and
+  contextualization_output = 'long log'
+)
+deploy front 1""")
+    def test_cluster_store_select(self, mo, makedirs, listdirs):
+        listdirs.return_value = ["cluster1"]
+        r = ClusterStore.load("cluster1", aspects=("system front", "network"), features=CmdSsh.FEATURES)
+        self.assertEqual([ (type(a).__name__, a.getId()) for a in r.aspects ],
+                         [ ("network", "public"), ("system", "front") ])
+        s = r.get(system("front"))
+        self.assertEqual(sorted(s.props.keys()), ["disk.0.os.credentials.username",
+                                                   "net_interface.0.connection", "net_interface.0.ip"])
+        self.assertEqual(getPublicIP(s), "8.8.8.8")
+        self.assertEqual(get_out_port(r, 22), 2222)
+        r = ClusterStore.load("cluster1", aspects=("system front", "network"), features=CmdList.FEATURES)
+        self.assertEqual(r.get(system("front")).getValue("__infrastructure_id"), "infid")
+        self.assertFalse(r.get(system("front")).hasFeature("contextualization_output"))
+
+    def test_cluster_store_submitted(self):
+        tmpdir = tempfile.mkdtemp()
+        old_dir, ClusterStore.DIR = ClusterStore.DIR, tmpdir
+        try:
+            radl = "network public (outbound = 'yes')\nsystem front (net_interface.0.connection = 'public')"
+            ClusterStore.write("cluster1", radl)
+            self.assertIsNone(ClusterStore.load_submitted("cluster1"))
+            ClusterStore.save_submitted("cluster1", radl)
+            self.assertEqual(ClusterStore.list(), ["cluster1"])
+            r = ClusterStore.load_submitted("cluster1")
+            self.assertIs(r.get(system("front")).getValue("net_interface.0.connection"), r.get(network("public")))
+            ClusterStore.remove("cluster1")
+            self.assertEqual(os.listdir(tmpdir), [])
+        finally:
+            ClusterStore.DIR = old_dir
+            shutil.rmtree(tmpdir)
 
     def test_cli(self):
         testargs = ["ec3", "list"]
@@ -438,9 +660,9 @@ deploy front 1
     @patch('ec3.CLI.display')
     def test_reconf(self, display, cluster_store, requests):
         Options = namedtuple('Options', ['restapi', 'json', 'clustername', 'reload', 'yes',
-                                         'auth_file', 'add', 'new_template', 'force'])
+                                         'auth_file', 'add', 'new_template', 'force', 'dry_run'])
         options = Options(restapi=['http://server.com:8800'], json=False, clustername='name', reload=False, yes=True,
-                          auth_file=[], add=[], new_template=None, force=False)
+                          auth_file=[], add=[], new_template=None, force=False, dry_run=False)
 
         cluster_store.list.return_value = ["name"]
         radl, _ = self.gen_radl()
@@ -552,14 +774,15 @@ deploy front 1
     @patch('ec3.ClusterStore')
     @patch('ec3.CLI.display')
     def test_update(self, display, cluster_store, requests):
-        Options = namedtuple('Options', ['restapi', 'clustername', 'auth_file', 'add'])
+        Options = namedtuple('Options', ['restapi', 'clustername', 'auth_file', 'add', 'dry_run'])
         options = Options(restapi=['http://server.com:8800'], clustername='name', 
-                          auth_file=[], add=["system wn ( cpu.count = 4 )"])
+                          auth_file=[], add=["system wn ( cpu.count = 4 )"], dry_run=False)
 
         cluster_store.list.return_value = ["name"]
         radl, _ = self.gen_radl()
         radl.get(system("front")).setValue("ec3_templates_cmd", "ubuntu-ec2 kubernetes")
         cluster_store.load.return_value = radl
+        cluster_store.load_submitted.return_value = None
         auth = [{"type": "InfrastructureManager", "username": "user", "password": "pass"}]
         cluster_store.get_im_server_infrId_and_vmId_and_auth.return_value = "http://server.com", "infid", "0", auth
         requests.side_effect = self.get_response
@@ -571,6 +794,93 @@ deploy front 1
         self.assertEquals(requests.call_args_list[0][0][1], "http://server.com/infrastructures/infid")
         radlo = parse_radl(requests.call_args_list[0][1]['data'])
         self.assertEquals(radlo.get(system("wn")).getValue("cpu.count"), 4)
+        # Without the submitted RADL, the whole RADL is sent, and stored for the next time
+        self.assertIsNotNone(radlo.get(configure("front")))
+        cluster_store.save_submitted.assert_called_once_with("name", requests.call_args_list[0][1]['data'])
+
+    @patch('requests.request')
+    @patch('ec3.ClusterStore')
+    @patch('ec3.CLI.display')
+    def test_update_changed_aspects(self, display, cluster_store, requests):
+        Options = namedtuple('Options', ['restapi', 'clustername', 'auth_file', 'add', 'dry_run'])
+        options = Options(restapi=['http://server.com:8800'], clustername='name',
+                          auth_file=[], add=["system wn ( cpu.count = 4 )"], dry_run=True)
+
+        auth = [{"type": "InfrastructureManager", "username": "user", "password": "pass"}]
+        # The cluster file has the RADL of the front-end returned by the IM, and the RADL
+        # submitted on launch is stored apart
+        cluster_store.load.return_value = parse_radl("""
+network public (outbound = 'yes')
+network private ()
+system front (
+  state = 'configured' and
+  net_interface.0.connection = 'private' and
+  net_interface.1.connection = 'public' and
+  net_interface.1.ip = '8.8.8.8' and
+  ec3_templates_cmd = 'ubuntu-ec2 kubernetes' and
+  __infrastructure_id = 'infid' and
+  __vm_id = '0' and
+  nodes = 0
+)""")
+        launched = CmdLaunch.generate_radl(["ubuntu-ec2", "kubernetes"], [], Authentication.dump(auth))
+        cluster_store.load_submitted.return_value = parse_radl(ec3_dump_radl(launched, order_deploys=True))
+        cluster_store.load_submitted.return_value.check()
+        cluster_store.get_im_server_infrId_and_vmId_and_auth.return_value = "http://server.com", "infid", "0", auth
+        requests.side_effect = self.get_response
+
+        with self.assertRaises(SystemExit) as ex:
+            CmdUpdate.run(options)
+        self.assertEquals("0" ,str(ex.exception))
+        self.assertEquals(requests.call_count, 0)
+        self.assertEquals(cluster_store.save_submitted.call_count, 0)
+        radlo = parse_radl(display.call_args_list[-1][0][0])
+        self.assertEquals(sorted((type(a).__name__, a.getId()) for a in radlo.aspects),
+                          [("configure", "front"), ("network", "private"), ("system", "wn")])
+        self.assertEquals(radlo.get(system("wn")).getValue("cpu.count"), 4)
+
+        options = options._replace(dry_run=False, add=[])
+        with self.assertRaises(SystemExit) as ex:
+            CmdUpdate.run(options)
+        self.assertEquals("0" ,str(ex.exception))
+        self.assertEquals(requests.call_args_list[0][1]['data'], "")
+
+        # Regenerating the submitted RADL with the same pieces sends an empty delta, and the
+        # RADL regenerated is stored as the submitted one
+        piece = "system wn ( cpu.count = 4 )"
+        launched = CmdLaunch.generate_radl(["ubuntu-ec2", "kubernetes"], [piece], Authentication.dump(auth))
+        cluster_store.load_submitted.return_value = parse_radl(ec3_dump_radl(launched, order_deploys=True))
+        cluster_store.load_submitted.return_value.check()
+        requests.reset_mock()
+        with self.assertRaises(SystemExit) as ex:
+            CmdUpdate.run(options._replace(add=[piece]))
+        self.assertEquals("0" ,str(ex.exception))
+        self.assertEquals(requests.call_args_list[0][1]['data'], "")
+        submitted = parse_radl(cluster_store.save_submitted.call_args[0][1])
+        self.assertEquals(submitted.get(system("wn")).getValue("cpu.count"), 4)
+
+        Options = namedtuple('Options', ['restapi', 'json', 'clustername', 'reload', 'yes',
+                                         'auth_file', 'add', 'new_template', 'force', 'dry_run'])
+        options = Options(restapi=['http://server.com:8800'], json=False, clustername='name', reload=True, yes=True,
+                          auth_file=[], add=[piece], new_template=None, force=False, dry_run=False)
+        requests.reset_mock()
+        with patch.object(CmdLaunch, 'wait_transfer_save'):
+            with self.assertRaises(SystemExit) as ex:
+                CmdReconfigure.run(options)
+        self.assertEquals("0" ,str(ex.exception))
+        self.assertEquals(requests.call_args_list[0][0][:2], ("PUT", "http://server.com/infrastructures/infid/reconfigure"))
+        self.assertEquals(requests.call_args_list[0][1]['data'], "")
+
+        # The cluster file alone lacks the configures and the other systems, so clusters
+        # launched before storing the submitted RADL get the whole of it
+        cluster_store.load_submitted.return_value = None
+        requests.reset_mock()
+        with patch.object(CmdLaunch, 'wait_transfer_save'):
+            with self.assertRaises(SystemExit) as ex:
+                CmdReconfigure.run(options)
+        self.assertEquals("0" ,str(ex.exception))
+        radlo = parse_radl(requests.call_args_list[0][1]['data'])
+        self.assertEquals(sorted(str(a.getKey()) for a in radlo.aspects),
+                          sorted(str(a.getKey()) for a in launched.aspects if not isinstance(a, deploy)))
 
 if __name__ == "__main__":
     unittest.main()